@@ -0,0 +1,178 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+import metrics
+from config import (
+    ADMISSION_CHAT_LIMIT,
+    ADMISSION_COMMAND_LIMITS,
+    ADMISSION_USER_LIMIT,
+)
+from outcomes import GAMES
+
+# Контроль допуска: обновления сверх квоты отбрасываются до обработчиков,
+# то есть до любых обращений к хранилищу. Квоты считаются скользящим окном
+# в памяти: по пользователю, по чату и по команде в чате. Учитываются только
+# запросы, на которые бот отвечает (ACTIONABLE): обычная переписка в группе
+# квоту не расходует.
+
+# Классы запросов (command_of), для которых есть обработчик
+ACTIONABLE = {"start", "free_tokens", "cookie", "cookie_button", "stats", "game"}
+
+class SlidingWindowCounter:
+    """
+    Приближенное скользящее окно: счетчики текущего и предыдущего
+    фиксированных окон, предыдущий учитывается с весом оставшейся доли.
+    O(1) на проверку и несколько чисел на ключ
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = 100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        # key -> [номер окна, счетчик текущего окна, счетчик предыдущего, был ли отказ в окне]
+        # Порядок - от давно не активных ключей к недавним
+        self._counts: "OrderedDict[Hashable, List]" = OrderedDict()
+
+    def _prune(self, index: int):
+        """
+        Удаляет ключи, не активные два окна подряд. Они собраны в начале словаря,
+        поэтому каждый ключ удаляется один раз - O(1) в среднем на событие.
+        Активные ключи не удаляются: сверх max_keys словарь растет только за счет них
+        """
+        while self._counts:
+            key, entry = next(iter(self._counts.items()))
+            if entry[0] >= index - 1:
+                break
+            del self._counts[key]
+
+    def hit(self, key: Hashable, now: float = None) -> Tuple[bool, bool]:
+        """
+        Учитывает событие. Возвращает (допущено, первый_отказ_в_окне)
+        Отклоненные события не занимают квоту
+        """
+        if now is None:
+            now = time.monotonic()
+        index, offset = divmod(now, self.window)
+        entry = self._counts.get(key)
+        if entry is None:
+            if len(self._counts) >= self.max_keys:
+                self._prune(index)
+            entry = self._counts[key] = [index, 0, 0, False]
+        else:
+            self._counts.move_to_end(key)
+        if entry[0] != index:
+            # Окно сдвинулось: текущее становится предыдущим (или обнуляется после паузы)
+            entry[2] = entry[1] if entry[0] == index - 1 else 0
+            entry[0], entry[1], entry[3] = index, 0, False
+
+        estimate = entry[2] * (1 - offset / self.window) + entry[1]
+        if estimate < self.limit:
+            entry[1] += 1
+            return True, False
+        first = not entry[3]
+        entry[3] = True
+        return False, first
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+REJECTED_ALERT = "⏳ Слишком много запросов, подождите немного"
+
+def _command(text: Optional[str], callback_data: Optional[str]) -> Optional[str]:
+    if text and text.startswith("/"):
+        name = text[1:].partition(" ")[0].partition("@")[0]
+        if name.startswith("stats_"):
+            return "stats"
+    elif callback_data:
+        name = callback_data
+        if name.startswith("stats_"):
+            return "stats"
+        if name.startswith("cookie_"):
+            return "cookie_button"
+    else:
+        return None
+    return "game" if name in GAMES else name
+
+def command_of(update: Update) -> Optional[str]:
+    """Класс запроса для квоты по команде: stats, cookie, cookie_button, game и т.п."""
+    message = update.message
+    query = update.callback_query
+    return _command(message.text if message else None, query.data if query else None)
+
+def subject_of(data: dict) -> Tuple[Optional[int], Optional[int], Optional[str]]:
+    """(user_id, chat_id, команда) обновления в виде JSON, без разбора в объекты PTB"""
+    for kind, payload in data.items():
+        if isinstance(payload, dict):
+            break
+    else:
+        return None, None, None
+    user = payload.get("from") or payload.get("user")
+    chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+    command = _command(
+        payload.get("text") if kind == "message" else None,
+        payload.get("data") if kind == "callback_query" else None,
+    )
+    return user["id"] if user else None, chat["id"] if chat else None, command
+
+class AdmissionControl:
+    def __init__(self, user_limit=ADMISSION_USER_LIMIT, chat_limit=ADMISSION_CHAT_LIMIT,
+                 command_limits=ADMISSION_COMMAND_LIMITS):
+        self.users = SlidingWindowCounter(*user_limit)
+        self.chats = SlidingWindowCounter(*chat_limit)
+        self.commands = {command: SlidingWindowCounter(*limit) for command, limit in command_limits.items()}
+
+    def check(self, user_id: Optional[int], chat_id: Optional[int], command: Optional[str]) -> Tuple[Optional[str], bool]:
+        """Возвращает (None, False), если допущено, иначе (квота, первый_отказ_в_окне)"""
+        if command not in ACTIONABLE:
+            return None, False
+        now = time.monotonic()
+        if user_id is not None:
+            allowed, first = self.users.hit(user_id, now)
+            if not allowed:
+                return "user", first
+        if chat_id is not None:
+            allowed, first = self.chats.hit(chat_id, now)
+            if not allowed:
+                return "chat", first
+        counter = self.commands.get(command)
+        if counter is not None:
+            allowed, first = counter.hit((chat_id, command), now)
+            if not allowed:
+                return command, first
+        return None, False
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "tracked_users": len(self.users),
+            "tracked_chats": len(self.chats),
+        }
+
+admission = AdmissionControl()
+
+async def admit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик группы -1: отбрасывает обновления сверх квоты до остальных обработчиков"""
+    user = update.effective_user
+    chat = update.effective_chat
+    scope, first = admission.check(user.id if user else None, chat.id if chat else None, command_of(update))
+    if scope is None:
+        return
+    metrics.counter("admission_rejections_total", scope=scope).inc()
+    # Предупреждаем один раз за окно, остальные запросы отбрасываются молча
+    if first and update.callback_query:
+        await update.callback_query.answer(REJECTED_ALERT, show_alert=True)
+    raise ApplicationHandlerStop
+
+def admit_data(data: dict) -> Tuple[Optional[str], bool]:
+    """
+    То же для обновления в виде JSON: при шардировании квоты считает головной
+    процесс - только он видит все обновления пользователя и чата
+    """
+    scope, first = admission.check(*subject_of(data))
+    if scope is not None:
+        metrics.counter("admission_rejections_total", scope=scope).inc()
+    return scope, first
@@ -0,0 +1,100 @@
+"""
+Пропускная способность SQLite для каждого профиля из config.DB_PROFILES
+
+Для каждого профиля замеряются:
+  - одиночные коммиты (обновление баланса с коммитом на каждую операцию)
+  - групповые коммиты (пакеты по --batch операций, как в очереди записи)
+  - чтение статистики отдельным соединением на фоне непрерывной записи
+
+    python benchmarks/connection_profiles.py --ops 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import leaderboard
+import migrations
+from config import DB_PROFILES
+
+def prepare(path: str, profile: str, users: int):
+    conn = database.connect(path, profile)
+    migrations.migrate(conn)
+    conn.executemany('INSERT INTO users (user_id, username, tokens) VALUES (?, ?, 10000)',
+                     ((u, f'user{u}') for u in range(users)))
+    conn.commit()
+    return conn
+
+def single_commits(conn, ops: int, users: int) -> float:
+    start = time.perf_counter()
+    for i in range(ops):
+        conn.execute('UPDATE users SET tokens = tokens + 1 WHERE user_id = ?', (i % users,))
+        conn.commit()
+    return ops / (time.perf_counter() - start)
+
+def batched_commits(conn, ops: int, users: int, batch: int) -> float:
+    start = time.perf_counter()
+    for first in range(0, ops, batch):
+        conn.executemany('UPDATE users SET tokens = tokens + 1 WHERE user_id = ?',
+                         ((i % users,) for i in range(first, min(first + batch, ops))))
+        conn.commit()
+    return ops / (time.perf_counter() - start)
+
+def reads_under_writes(path: str, profile: str, conn, users: int, duration: float) -> float:
+    """Число запросов статистики в секунду, пока другой поток пишет"""
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            conn.execute('UPDATE users SET tokens = tokens + 1 WHERE user_id = ?', (i % users,))
+            conn.commit()
+            i += 1
+
+    reader_conn = database.connect(path, profile, read_only=database.uses_stats_reader(profile))
+    reader = reader_conn.cursor()
+    thread = threading.Thread(target=writer)
+    thread.start()
+    reads = 0
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < duration:
+            try:
+                leaderboard.query_top(reader, 'all', 0, limit=10)
+                reads += 1
+            except Exception:
+                # Журнал отката: читатель упирается в блокировку писателя
+                pass
+    finally:
+        stop.set()
+        thread.join()
+        reader_conn.close()
+    return reads / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=2.0)
+    parser.add_argument('--profiles', nargs='+', default=list(DB_PROFILES))
+    args = parser.parse_args()
+
+    print(f'{"профиль":<10}{"коммит/оп, оп/с":>18}{"пакеты, оп/с":>16}{"чтения при записи, /с":>24}')
+    for profile in args.profiles:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.sqlite')
+            conn = prepare(path, profile, args.users)
+            single = single_commits(conn, args.ops, args.users)
+            batched = batched_commits(conn, args.ops, args.users, args.batch)
+            reads = reads_under_writes(path, profile, conn, args.users, args.duration)
+            conn.close()
+        print(f'{profile:<10}{single:>18,.0f}{batched:>16,.0f}{reads:>24,.0f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Проверка обработчика "Печеньки" на подделанных callback_data
+
+Клиент может прислать любые данные кнопки. Нажатия на ячейки вне поля и
+данные, которые не разбираются в координаты, не должны менять ни баланс
+игрока, ни состояние игры. Бот работает через настоящие обработчики
+с FakeBotAPI (см. replay_load.py) и хранилищем в памяти.
+
+    python benchmarks/forged_callbacks.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+
+from replay_load import REPLY_ID_BASE, FakeBotAPI, Replay
+
+USER_ID = 1
+FORGED = [f"cookie_{x}_{y}" for x, y in ((5, 0), (9, 0), (9, 4), (0, 5), (-1, 0), (0, -1), (25, 0))] + [
+    "cookie_a_b", "cookie_1", "cookie_1_2_3",
+]
+
+async def check():
+    import storage
+    from cookie_game import get_game
+    from main import build_application
+    from storage_memory import MemoryBackend
+
+    storage.use_backend(MemoryBackend())
+    await storage.init_db()
+    application = build_application("1:FAKE", with_updater=False, request=FakeBotAPI(), rate_limited=False,
+                                    admission_control=False)
+    await application.initialize()
+
+    async def process(data: dict):
+        await application.process_update(Update.de_json(data, application.bot))
+
+    replay = Replay(chats=1, actions=0, seed=1)
+    await storage.ensure_user_exists(USER_ID, "forger")
+    await storage.update_user_tokens(USER_ID, 10000, "free")
+    command = replay.command(USER_ID, "/cookie")
+    await process(command)
+    message_id = REPLY_ID_BASE + command["message"]["message_id"]
+    game = get_game(-1, message_id)
+    assert game is not None, "игра не началась"
+
+    balance = await storage.get_user_tokens(USER_ID)
+    state = game.to_bytes()
+    for data in FORGED:
+        await process(replay.button(USER_ID, data, message_id))
+        assert game.to_bytes() == state, data
+        assert get_game(-1, message_id) is game, data
+    await process(replay.button(USER_ID, "cookie_claim", message_id))
+    assert await storage.get_user_tokens(USER_ID) == balance
+    await application.shutdown()
+    return len(FORGED)
+
+def main():
+    forged = asyncio.run(check())
+    print(f"подделанных нажатий: {forged}, баланс и состояние игры не изменились")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Замер времени запросов статистики на синтетической истории игр
+
+    python benchmarks/history_queries.py --rows 1000000 10000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import leaderboard
+import migrations
+
+# Запрос статистики до появления агрегатов и индексов
+LEGACY_QUERY = '''
+    SELECT u.username, u.tokens
+    FROM users u
+    WHERE EXISTS (
+        SELECT 1 FROM game_history h
+        WHERE h.user_id = u.user_id
+        AND h.chat_id = ?
+        AND played_at >= datetime('now', '-1 day')
+    )
+    AND u.tokens > 0
+    ORDER BY u.tokens DESC
+'''
+
+GAMES = ('dart', 'dice', 'basketball', 'football', 'slot', 'bowling')
+
+def build_db(path: str, rows: int, users: int, chats: int):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    # Схема без индексов истории - они создаются отдельно
+    conn.execute('BEGIN')
+    migrations.MIGRATIONS[0](conn.cursor())
+    conn.execute('PRAGMA user_version = 1')
+    conn.commit()
+
+    rnd = random.Random(42)
+    conn.executemany('INSERT INTO users (user_id, username, tokens) VALUES (?, ?, ?)',
+                     ((u, f'user{u}', rnd.randint(0, 100000)) for u in range(users)))
+    conn.executemany('INSERT INTO chats (chat_id) VALUES (?)', ((c,) for c in range(chats)))
+    now = int(time.time())
+    month = 30 * 86400
+    conn.executemany('''
+        INSERT INTO game_history (user_id, chat_id, game_id, points, played_at)
+        VALUES (?, ?, ?, ?, datetime(?, 'unixepoch'))
+    ''', ((rnd.randrange(users), rnd.randrange(chats), rnd.choice(GAMES), 600, now - rnd.randrange(month))
+          for _ in range(rows)))
+    conn.commit()
+    return conn
+
+def timed(conn, query: str, params, repeat: int, limit: float) -> str:
+    """Среднее время запроса; запрос прерывается, если идет дольше limit секунд"""
+    deadline = time.perf_counter() + limit
+    conn.set_progress_handler(lambda: time.perf_counter() > deadline, 10000)
+    start = time.perf_counter()
+    try:
+        for _ in range(repeat):
+            conn.execute(query, params).fetchall()
+    except sqlite3.OperationalError:
+        return f'> {limit * 1000:.0f} мс (прервано)'
+    finally:
+        conn.set_progress_handler(None, 0)
+    return f'{(time.perf_counter() - start) / repeat * 1000:.2f} мс'
+
+def run(rows: int, users: int, chats: int, repeat: int, limit: float):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.sqlite')
+        print(f'Строк истории: {rows:,}')
+        start = time.perf_counter()
+        conn = build_db(path, rows, users, chats)
+        print(f'  генерация: {time.perf_counter() - start:.1f} с')
+
+        chat_id = 0
+        print(f'  без индексов:        {timed(conn, LEGACY_QUERY, (chat_id,), repeat, limit)}')
+
+        start = time.perf_counter()
+        migrations.migrate(conn)
+        print(f'  миграции: {time.perf_counter() - start:.1f} с')
+        print(f'  с индексами:         {timed(conn, LEGACY_QUERY, (chat_id,), repeat, limit)}')
+
+        cursor = conn.cursor()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            leaderboard.query_top(cursor, 'day', chat_id, limit=10)
+        print(f'  агрегаты (топ-10):   {(time.perf_counter() - start) / repeat * 1000:.2f} мс')
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--limit', type=float, default=30.0, help='предел времени одного замера, с')
+    args = parser.parse_args()
+    for rows in args.rows:
+        run(rows, args.users, args.chats, args.repeat, args.limit)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+Нагрузочный тест бота целиком: синтетические пользователи через настоящие обработчики
+
+Вместо Telegram Bot API подставляется FakeBotAPI (telegram.request.BaseRequest),
+который отвечает из памяти: sendDice выдает детерминированные значения,
+sendMessage/editMessageText возвращают сообщение, остальное - true.
+Каждый пользователь проигрывает свой сценарий: /free_tokens, броски
+(командой и кнопкой), партии "Печеньки", /stats_*, повторные /free_tokens.
+База SQLite создается во временном каталоге; --backend memory
+измеряет бота без диска, --backend postgres пишет в базу POSTGRES_DSN
+(только тестовую: таблицы бота заполняются синтетическими игроками). Квоты допуска (admission.py) по умолчанию
+выключены: сценарий намеренно плотнее живых пользователей, и квоты
+отбросили бы значительную часть нагрузки; --admission включает их.
+
+Отчет: пропускная способность, p50/p99 задержки расчета броска относительно
+запланированного момента (отрицательная - планировщик забрал бросок в пачку
+раньше срока, в пределах SETTLEMENT_TICK), коммиты SQLite на обновление,
+рост памяти.
+
+    python benchmarks/replay_load.py --users 2000 --chats 200 --actions 10
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+GAMES = ("dart", "dice", "basketball", "football", "slot", "bowling")
+# Число граней анимированных эмодзи Telegram
+DICE_FACES = {"🎯": 6, "🎲": 6, "🏀": 5, "⚽": 5, "🎰": 64, "🎳": 6}
+STATS = ("all", "month", "week", "day", "hour")
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+# Ответ бота на сообщение получает номер REPLY_ID_BASE + номер исходного сообщения:
+# сценарий знает номер поля "Печеньки" заранее и не ждет ответа обработчика
+REPLY_ID_BASE = 1_000_000_000
+
+class FakeBotAPI(BaseRequest):
+    """Bot API в памяти с детерминированными значениями кубиков"""
+
+    def __init__(self, seed: int = 1, latency: float = 0.0):
+        self._rnd = random.Random(seed)
+        self.latency = latency
+        self._message_ids = itertools.count(1_000_000)
+        self.calls = {}
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, chat_id, message_id: int = None, **fields) -> dict:
+        message = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if int(chat_id) < 0 else "private"},
+            "from": BOT_USER,
+        }
+        message.update(fields)
+        return message
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        # Как и настоящий сетевой запрос, ответ отдает управление event loop
+        await asyncio.sleep(self.latency)
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        params = request_data.parameters if request_data else {}
+
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint == "sendDice":
+            emoji = params.get("emoji", "🎲")
+            faces = DICE_FACES.get(emoji.rstrip("️"), 6)
+            result = self._message(params["chat_id"], dice={"emoji": emoji, "value": self._rnd.randint(1, faces)})
+        elif endpoint in ("sendMessage", "editMessageText"):
+            reply = params.get("reply_parameters") if endpoint == "sendMessage" else None
+            result = self._message(
+                params.get("chat_id", 0),
+                message_id=REPLY_ID_BASE + reply["message_id"] if reply else None,
+                text=params.get("text", ""),
+            )
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+class Replay:
+    """
+    Сценарии пользователей в виде обновлений Bot API (JSON). Сценарий - последовательность
+    действий, действие - список обновлений (партия "Печеньки" - команда и нажатия кнопок)
+    """
+
+    def __init__(self, chats: int, actions: int, seed: int):
+        self.chats = chats
+        self.actions = actions
+        self.seed = seed
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"u{user_id}", "username": f"user{user_id}"}
+
+    def _chat(self, user_id: int) -> dict:
+        return {"id": -(1 + user_id % self.chats), "type": "group"}
+
+    def command(self, user_id: int, text: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": self._chat(user_id),
+                "from": self._user(user_id),
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+            },
+        }
+
+    def button(self, user_id: int, data: str, message_id: int = None) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": "0",
+                "data": data,
+                "message": {
+                    "message_id": message_id or next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": self._chat(user_id),
+                    "from": BOT_USER,
+                    "text": "...",
+                },
+            },
+        }
+
+    def cookie_session(self, user_id: int, rnd: random.Random) -> list:
+        command = self.command(user_id, "/cookie")
+        # Поле игры - ответ бота на команду (см. FakeBotAPI)
+        message_id = REPLY_ID_BASE + command["message"]["message_id"]
+        cells = rnd.sample([(x, y) for x in range(5) for y in range(5)], rnd.randint(1, 5))
+        updates = [command] + [self.button(user_id, f"cookie_{x}_{y}", message_id) for x, y in cells]
+        if rnd.random() < 0.5:
+            updates.append(self.button(user_id, "cookie_claim", message_id))
+        return updates
+
+    def user(self, user_id: int):
+        """Сценарий пользователя: список действий"""
+        rnd = random.Random(self.seed * 1_000_003 + user_id)
+        yield [self.command(user_id, "/free_tokens")]
+        for _ in range(self.actions):
+            roll = rnd.random()
+            if roll < 0.3:
+                yield [self.command(user_id, f"/{rnd.choice(GAMES)}")]
+            elif roll < 0.5:
+                yield [self.button(user_id, rnd.choice(GAMES))]
+            elif roll < 0.75:
+                yield self.cookie_session(user_id, rnd)
+            elif roll < 0.9:
+                yield [self.command(user_id, f"/stats_{rnd.choice(STATS)}")]
+            elif roll < 0.95:
+                yield [self.command(user_id, "/free_tokens")]
+            else:
+                yield [self.command(user_id, "/start")]
+
+def percentile(values, q: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def run(args) -> dict:
+    import database
+    import handlers
+    import metrics
+    import storage
+    from cookie_game import active_games
+    from main import build_application
+    from settlement import scheduler
+
+    # Анимацию сокращаем, иначе прогон упирается в ожидание, а не в работу бота
+    for game in handlers.ANIMATION_DURATIONS:
+        handlers.ANIMATION_DURATIONS[game] = args.animation
+
+    commits = []
+    if args.backend == "sqlite":
+        database.open_connection(os.path.join(args.dir, "replay.sqlite"))
+        await storage.init_db()
+        database.conn.set_trace_callback(lambda sql: sql.startswith("COMMIT") and commits.append(1))
+    else:
+        from storage_backend import create_backend
+        storage.use_backend(create_backend(args.backend))
+        await storage.init_db()
+
+    # Задержка расчета: от запланированного момента до отправки результата
+    lags = []
+    schedule = scheduler.schedule
+
+    def timed_schedule(delay, job):
+        due = time.perf_counter() + delay
+
+        async def timed_job():
+            await job()
+            lags.append(time.perf_counter() - due)
+        schedule(delay, timed_job)
+    scheduler.schedule = timed_schedule
+
+    fake = FakeBotAPI(args.seed, args.api_latency)
+    application = build_application("1:FAKE", with_updater=False, request=fake, rate_limited=args.rate_limit,
+                                    admission_control=args.admission)
+    await application.initialize()
+    scheduler.on_batch = storage.flush_pending
+    tasks = [asyncio.create_task(scheduler.run()), asyncio.create_task(storage.flush_periodically())]
+
+    replay = Replay(args.chats, args.actions, args.seed)
+    limit = asyncio.Semaphore(args.concurrency)
+    updates = 0
+
+    async def user(user_id):
+        nonlocal updates
+        think = random.Random(args.seed * 7 + user_id)
+        async with limit:
+            for action in replay.user(user_id):
+                for data in action:
+                    updates += 1
+                    await application.process_update(Update.de_json(data, application.bot))
+                if args.think:
+                    await asyncio.sleep(think.uniform(0, 2 * args.think))
+
+    rss_before = max_rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(1, args.users + 1)))
+    handled = time.perf_counter() - started
+    await scheduler.drain()
+    await storage.flush_pending()
+    elapsed = time.perf_counter() - started
+
+    for task in tasks:
+        task.cancel()
+    await storage.close()
+    await application.shutdown()
+    storage.shutdown()
+
+    handler_p99 = {
+        dict(labels)["handler"]: metric.quantile(0.99)
+        for (name, labels), metric in metrics._histograms.items()
+        if name == "handler_seconds" and metric.count
+    }
+    return {
+        "updates": updates,
+        "handled": handled,
+        "elapsed": elapsed,
+        "settled": len(lags),
+        "lag_p50": percentile(lags, 50),
+        "lag_p99": percentile(lags, 99),
+        "commits": len(commits),
+        "rss_before": rss_before,
+        "rss_after": max_rss_mb(),
+        "live_sessions": len(active_games),
+        "api_calls": sum(fake.calls.values()),
+        "handler_p99": handler_p99,
+        "cooldown_rejections": sum(
+            metric.value for (name, _), metric in metrics._counters.items() if name == "cooldown_rejections_total"
+        ),
+        "admission_rejections": sum(
+            metric.value for (name, _), metric in metrics._counters.items() if name == "admission_rejections_total"
+        ),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--actions", type=int, default=10, help="действий на пользователя после /free_tokens")
+    parser.add_argument("--concurrency", type=int, default=500, help="одновременно активных пользователей")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза между действиями, с")
+    parser.add_argument("--animation", type=float, default=0.05, help="длительность анимации броска, с")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, с")
+    parser.add_argument("--backend", choices=["sqlite", "memory", "postgres"], default="sqlite", help="хранилище")
+    parser.add_argument("--rate-limit", action="store_true", help="включить OutboundRateLimiter")
+    parser.add_argument("--admission", action="store_true", help="включить квоты допуска")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        args.dir = directory
+        result = asyncio.run(run(args))
+
+    print(f"Пользователей: {args.users}, чатов: {args.chats}, обновлений: {result['updates']}")
+    print(f"  пропускная способность: {result['updates'] / result['handled']:10,.0f} обн/с "
+          f"(обработка {result['handled']:.2f} с, с расчетом бросков {result['elapsed']:.2f} с)")
+    print(f"  расчет бросков:         {result['settled']} шт, задержка p50 {result['lag_p50'] * 1000:.1f} мс, "
+          f"p99 {result['lag_p99'] * 1000:.1f} мс")
+    if args.backend == "sqlite":
+        print(f"  коммиты SQLite:         {result['commits']} ({result['commits'] / result['updates']:.3f} на обновление)")
+    print(f"  вызовы Bot API:         {result['api_calls']} ({result['api_calls'] / result['updates']:.2f} на обновление)")
+    if args.admission:
+        rejected = result["admission_rejections"]
+        print(f"  квоты допуска:          допущено {result['updates'] - rejected}, отклонено {rejected}")
+    else:
+        print("  квоты допуска:          выключены (--admission)")
+    print(f"  отказы по кулдауну:     {result['cooldown_rejections']}")
+    print(f"  память (max RSS):       {result['rss_before']:.1f} -> {result['rss_after']:.1f} МБ, "
+          f"живых игр \"Печенька\": {result['live_sessions']}")
+    print("  p99 обработчиков (верхняя граница корзины):")
+    for handler, seconds in sorted(result["handler_p99"].items()):
+        print(f"    {handler:22} {seconds * 1000:8.1f} мс")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Нагрузочный тест шардирования: пропускная способность в зависимости от числа воркеров
+
+Головной процесс берет сценарии пользователей из replay_load.Replay, перемешивает
+их в один поток обновлений и раскладывает по воркерам через sharding.Dispatcher.
+Каждый воркер - настоящий бот (main.build_application и sharding.serve) с
+FakeBotAPI вместо Telegram: обработчики, кулдауны в общей базе, списания,
+расчет бросков и очередь записи в один файл SQLite на всех.
+Время - до обработки последнего обновления и расчета всех бросков.
+Прирост ограничен числом ядер машины и одним писателем SQLite.
+
+    python benchmarks/shard_scaling.py --users 2000 --chats 200 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sharding
+from replay_load import Replay
+
+def make_updates(args) -> list:
+    """Сценарии пользователей, перемешанные по действиям с сохранением порядка внутри сценария"""
+    replay = Replay(args.chats, args.actions, args.seed)
+    rnd = random.Random(args.seed)
+    scripts = [replay.user(user_id) for user_id in range(1, args.users + 1)]
+    updates = []
+    while scripts:
+        index = rnd.randrange(len(scripts))
+        action = next(scripts[index], None)
+        if action is None:
+            scripts[index] = scripts[-1]
+            scripts.pop()
+        else:
+            updates.extend(action)
+    return updates
+
+def bench_worker(index: int, queue, shards: int, db_path: str, animation: float, done):
+    asyncio.run(_bench_worker(index, queue, shards, db_path, animation, done))
+
+async def _bench_worker(index: int, queue, shards: int, db_path: str, animation: float, done):
+    import database
+    import handlers
+    import metrics
+    import storage
+    from main import build_application
+    from replay_load import FakeBotAPI
+    from settlement import scheduler
+
+    # То же, что sharding._worker, но с FakeBotAPI и базой во временном каталоге
+    sharding.current_shard = index
+    database.shared_writers = True
+    handlers.shared_cooldowns = True
+    metrics.shard = index
+    for game in handlers.ANIMATION_DURATIONS:
+        handlers.ANIMATION_DURATIONS[game] = animation
+    database.open_connection(db_path)
+
+    fake = FakeBotAPI(seed=index + 1)
+    application = build_application("1:FAKE", with_updater=False, request=fake, rate_limited=False,
+                                    admission_control=False, shards=shards)
+    try:
+        processed = await sharding.serve(application, queue)
+    finally:
+        storage.shutdown()
+    done.put((processed, scheduler.settled, sum(fake.calls.values())))
+
+def run(workers: int, updates: list, args) -> dict:
+    import database
+    import migrations
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        # Схему создает головной процесс, как storage.prepare() в main
+        db_path = os.path.join(directory, "shards.sqlite")
+        connection = database.connect(db_path)
+        migrations.migrate(connection)
+        connection.close()
+
+        queues = [context.Queue(10000) for _ in range(workers)]
+        done = context.Queue()
+        processes = [
+            context.Process(target=bench_worker, args=(index, queue, workers, db_path, args.animation, done))
+            for index, queue in enumerate(queues)
+        ]
+        for process in processes:
+            process.start()
+        dispatcher = sharding.Dispatcher(queues, admission_control=args.admission)
+
+        async def feed():
+            for data in updates:
+                await dispatcher.dispatch(data)
+
+        start = time.perf_counter()
+        asyncio.run(feed())
+        for queue in queues:
+            queue.put(None)
+        results = [done.get() for _ in processes]
+        elapsed = time.perf_counter() - start
+        for process in processes:
+            process.join()
+
+    processed = sum(result[0] for result in results)
+    assert processed + dispatcher.rejected == len(updates)
+    return {
+        "processed": processed,
+        "rejected": dispatcher.rejected,
+        "settled": sum(result[1] for result in results),
+        "api_calls": sum(result[2] for result in results),
+        "dispatched": dispatcher.dispatched,
+        "rate": processed / elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--actions", type=int, default=10, help="действий на пользователя после /free_tokens")
+    parser.add_argument("--animation", type=float, default=0.05, help="длительность анимации броска, с")
+    parser.add_argument("--admission", action="store_true", help="включить квоты допуска в головном процессе")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    updates = make_updates(args)
+    print(f"Ядер: {os.cpu_count()}, пользователей: {args.users}, чатов: {args.chats}, обновлений: {len(updates)}")
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, updates, args)
+        baseline = baseline or result["rate"]
+        print(f"  воркеров {workers}: {result['rate']:10,.0f} обн/с  (x{result['rate'] / baseline:.2f}), "
+              f"бросков {result['settled']}, вызовов Bot API {result['api_calls']}, "
+              f"отклонено квотами {result['rejected']}, по воркерам {result['dispatched']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Проверка хранилища: запись через интерфейс StorageBackend и чтение обратно
+
+Проходит по всем операциям, которыми пользуется бот: пользователь, начисление,
+списание, выигрыш в истории, статистика из агрегатов, баланс и лидерборд на момент
+времени (через снимки баланса), кулдауны. SQLite проверяется во временном файле,
+PostgreSQL - во временной схеме базы POSTGRES_DSN, которая затем удаляется.
+Без POSTGRES_DSN или пакета asyncpg проверка PostgreSQL пропускается.
+
+    python benchmarks/storage_roundtrip.py                     # все хранилища
+    python benchmarks/storage_roundtrip.py --backend postgres
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage_backend import REASON_BET, REASON_FREE, SNAPSHOT_EVERY, StorageBackend
+
+USER_ID = 1
+CHAT_ID = -1
+
+async def roundtrip(backend: StorageBackend):
+    await backend.init()
+    before = time.time()
+    await asyncio.sleep(0.01)
+
+    await backend.ensure_user_exists(USER_ID, "roundtrip")
+    await backend.ensure_chat_exists(CHAT_ID)
+    await backend.update_user_tokens(USER_ID, 500, REASON_FREE)
+    assert await backend.get_user_tokens(USER_ID) == 500
+
+    assert await backend.try_debit(USER_ID, 200, REASON_BET) == 300
+    assert await backend.try_debit(USER_ID, 1000, REASON_BET) is None
+    assert await backend.get_user_tokens(USER_ID) == 300
+
+    await backend.update_player(USER_ID, "roundtrip", 50, CHAT_ID, "dice")
+    await backend.update_player(USER_ID, "roundtrip", 0, CHAT_ID, "dice")  # Проигрыш не записывается
+    await backend.flush_pending()
+    for period in ("all", "month", "week", "day", "hour"):
+        assert await backend.get_stats(period, CHAT_ID) == [("roundtrip", 350)], period
+    assert await backend.get_stats("all", CHAT_ID, limit=1, offset=1) == []
+
+    # Журнал длиннее SNAPSHOT_EVERY: баланс собирается из снимка и хвоста журнала
+    assert await backend.get_balance_at(USER_ID, before) == 0
+    for _ in range(SNAPSHOT_EVERY + 5):
+        await backend.update_user_tokens(USER_ID, 1, REASON_FREE)
+    await backend.flush_pending()
+    middle = time.time()
+    await asyncio.sleep(0.01)
+    await backend.update_user_tokens(USER_ID, 7, REASON_FREE)
+    await backend.flush_pending()
+    expected = 350 + SNAPSHOT_EVERY + 5
+    assert await backend.get_balance_at(USER_ID, middle) == expected
+    assert await backend.get_balance_at(USER_ID) == expected + 7 == await backend.get_user_tokens(USER_ID)
+    assert await backend.get_stats_at(CHAT_ID, before) == []
+    assert await backend.get_stats_at(CHAT_ID, middle) == [("roundtrip", expected)]
+    assert await backend.get_stats_at(CHAT_ID, time.time(), limit=1, offset=1) == []
+
+    assert await backend.claim_cooldown("roundtrip", USER_ID, 60) == 0
+    assert await backend.claim_cooldown("roundtrip", USER_ID, 60) > 0
+    await backend.release_cooldown("roundtrip", USER_ID)
+    assert await backend.claim_cooldown("roundtrip", USER_ID, 60) == 0
+    await backend.save_cooldown("roundtrip_saved", USER_ID, time.time() + 60)
+    await backend.flush_pending()
+    assert set(await backend.load_cooldowns("roundtrip_saved")) == {USER_ID}
+
+async def check_sqlite(directory: str):
+    import database
+    from storage_sqlite import SQLiteBackend
+
+    database.open_connection(os.path.join(directory, "roundtrip.sqlite"))
+    backend = SQLiteBackend()
+    try:
+        await roundtrip(backend)
+    finally:
+        await backend.close()
+        backend.shutdown()
+
+async def check_memory(directory: str):
+    from storage_memory import MemoryBackend
+
+    await roundtrip(MemoryBackend())
+
+async def check_postgres(directory: str):
+    from config import POSTGRES_DSN
+    from storage_postgres import PostgresBackend, asyncpg
+
+    if asyncpg is None or not POSTGRES_DSN:
+        return "пропущено: нужны asyncpg и POSTGRES_DSN"
+    backend = PostgresBackend(schema=f"roundtrip_{os.getpid()}")
+    try:
+        await roundtrip(backend)
+    finally:
+        if backend.pool is not None:
+            await backend.pool.execute(f'DROP SCHEMA IF EXISTS "{backend.schema}" CASCADE')
+        await backend.close()
+
+CHECKS = {"sqlite": check_sqlite, "memory": check_memory, "postgres": check_postgres}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=list(CHECKS), action="append", help="по умолчанию - все")
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.backend or CHECKS:
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                skipped = asyncio.run(CHECKS[name](directory))
+            except AssertionError:
+                failed = True
+                print(f"{name}: ошибка")
+                traceback.print_exc()
+                continue
+        print(f"{name}: {skipped or 'ok'}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
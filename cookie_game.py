@@ -1,81 +1,249 @@
+import asyncio
 import random
-from dataclasses import dataclass
-from typing import List, Dict, Tuple
+import struct
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-@dataclass
+from config import COOKIE_IDLE_TTL, COOKIE_MAX_SESSIONS, logger
+
 class CookieGame:
-    size: int = 5
-    bomb_count: int = 7  # Количество бомб на поле
-    base_reward: int = 500  # Увеличиваем базовую награду
-    field: List[List[bool]] = None  # True = бомба, False = приз
-    opened: List[List[bool]] = None  # True = открыто, False = закрыто
-    current_reward: int = 0
-    game_over: bool = False
-    player_id: int = None  # ID игрока, который начал игру
-
-    def __post_init__(self):
-        self.field = [[False for _ in range(self.size)] for _ in range(self.size)]
-        self.opened = [[False for _ in range(self.size)] for _ in range(self.size)]
-        self._place_bombs()
-        
-    def _place_bombs(self):
-        # Размещаем бомбы случайным образом
-        bombs_placed = 0
-        while bombs_placed < self.bomb_count:
-            x, y = random.randint(0, self.size-1), random.randint(0, self.size-1)
-            if not self.field[y][x]:
-                self.field[y][x] = True
-                bombs_placed += 1
+    """
+    Игра "Печенька" на поле size x size (до 8x8)
+    Бомбы и открытые ячейки хранятся битовыми масками: бит y * size + x
+    """
+    __slots__ = ('size', 'bomb_count', 'base_reward', 'bombs', 'opened',
+                 'current_reward', 'game_over', 'player_id', 'bet', '_keyboard')
+
+    MAX_SIZE = 8  # Поле должно помещаться в 64-битную маску
+    # size, bomb_count, base_reward, current_reward, game_over, player_id, bet, bombs, opened
+    _STRUCT = struct.Struct('<BBIIBqIQQ')
+
+    def __init__(self, size: int = 5, bomb_count: int = 7, base_reward: int = 500,
+                 player_id: int = None, bet: int = 0, bombs: int = None):
+        if not 0 < size <= self.MAX_SIZE:
+            raise ValueError(f"Размер поля должен быть от 1 до {self.MAX_SIZE}")
+        if not 0 <= bomb_count <= size * size:
+            raise ValueError("Бомб больше, чем ячеек")
+        self.size = size
+        self.bomb_count = bomb_count  # Количество бомб на поле
+        self.base_reward = base_reward  # Награда за каждую найденную печеньку
+        self.bombs = self._place_bombs() if bombs is None else bombs  # 1 = бомба
+        self.opened = 0  # 1 = открыто
+        self.current_reward = 0
+        self.game_over = False
+        self.player_id = player_id  # ID игрока, который начал игру
+        self.bet = bet  # Ставка, списанная при старте игры
+        self._keyboard = None  # (состояние, разметка) последней отрисовки
+
+    def _place_bombs(self) -> int:
+        # Выбираем bomb_count различных ячеек без повторных попыток
+        bombs = 0
+        for cell in random.sample(range(self.size * self.size), self.bomb_count):
+            bombs |= 1 << cell
+        return bombs
+
+    def contains(self, x: int, y: int) -> bool:
+        return 0 <= x < self.size and 0 <= y < self.size
+
+    def _bit(self, x: int, y: int) -> int:
+        # Вне поля бит попал бы в соседний ряд или за пределы маски
+        assert self.contains(x, y), (x, y)
+        return 1 << (y * self.size + x)
+
+    def is_bomb(self, x: int, y: int) -> bool:
+        return bool(self.bombs & self._bit(x, y))
+
+    def is_opened(self, x: int, y: int) -> bool:
+        return bool(self.opened & self._bit(x, y))
 
     def open_cell(self, x: int, y: int) -> Tuple[bool, int]:
         """Открывает ячейку. Возвращает (is_bomb, reward)"""
-        if self.opened[y][x] or self.game_over:
+        bit = self._bit(x, y)
+        if self.opened & bit or self.game_over:
             return False, self.current_reward
         
-        self.opened[y][x] = True
-        if self.field[y][x]:  # Бомба
+        self.opened |= bit
+        if self.bombs & bit:  # Бомба
             self.game_over = True
             return True, 0
         
         self.current_reward += self.base_reward
         return False, self.current_reward
 
+    def to_bytes(self) -> bytes:
+        """Компактное представление игры для хранения"""
+        return self._STRUCT.pack(
+            self.size, self.bomb_count, self.base_reward, self.current_reward,
+            self.game_over, self.player_id or 0, self.bet, self.bombs, self.opened
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CookieGame":
+        (size, bomb_count, base_reward, current_reward,
+         game_over, player_id, bet, bombs, opened) = cls._STRUCT.unpack(data)
+        game = cls(size, bomb_count, base_reward, player_id, bet, bombs)
+        game.current_reward = current_reward
+        game.game_over = bool(game_over)
+        game.opened = opened
+        return game
+
     def get_keyboard(self) -> InlineKeyboardMarkup:
-        keyboard = []
-        for y in range(self.size):
-            row = []
-            for x in range(self.size):
-                if self.opened[y][x]:  # Уже открытая ячейка
-                    text = "💣" if self.field[y][x] else "🍪"
-                elif self.game_over and self.field[y][x]:  # Неоткрытая бомба при game_over
-                    text = "💣"
-                elif self.game_over:  # Неоткрытая печенька при game_over
-                    text = "🥠"
-                else:  # Закрытая ячейка в процессе игры
-                    text = "⬜️"
-                row.append(InlineKeyboardButton(text, callback_data=f"cookie_{x}_{y}"))
-            keyboard.append(row)
-        
+        # Разметка зависит только от открытых ячеек и конца игры
+        state = (self.opened, self.game_over)
+        if self._keyboard is not None and self._keyboard[0] == state:
+            return self._keyboard[1]
+
+        row_mask = (1 << self.size) - 1
+        # В кэш отрисовки попадает только видимое: до конца игры - бомбы в открытых ячейках
+        shown = self.bombs if self.game_over else self.bombs & self.opened
+        keyboard = [
+            _render_row(self.size, y,
+                        (shown >> (y * self.size)) & row_mask,
+                        (self.opened >> (y * self.size)) & row_mask,
+                        self.game_over)
+            for y in range(self.size)
+        ]
         if not self.game_over:
-            keyboard.append([InlineKeyboardButton(
-                f"💰 Забрать приз ({self.current_reward} токенов)", 
-                callback_data="cookie_claim"
-            )])
-        
-        return InlineKeyboardMarkup(keyboard)
+            keyboard.append(_claim_row(self.current_reward))
+
+        markup = InlineKeyboardMarkup(keyboard)
+        self._keyboard = (state, markup)
+        return markup
+
+# Кнопки неизменяемы, поэтому ряды и callback_data переиспользуются между играми
+
+@lru_cache(maxsize=None)
+def _callback_data(size: int) -> Tuple[Tuple[str, ...], ...]:
+    return tuple(tuple(f"cookie_{x}_{y}" for x in range(size)) for y in range(size))
+
+@lru_cache(maxsize=4096)
+def _render_row(size: int, y: int, shown: int, opened: int, game_over: bool) -> Tuple[InlineKeyboardButton, ...]:
+    """Ряд кнопок; shown - видимые бомбы ряда (открытые, а после конца игры - все)"""
+    callbacks = _callback_data(size)[y]
+    row = []
+    for x in range(size):
+        bit = 1 << x
+        if opened & bit:  # Уже открытая ячейка
+            text = "💣" if shown & bit else "🍪"
+        elif game_over and shown & bit:  # Неоткрытая бомба при game_over
+            text = "💣"
+        elif game_over:  # Неоткрытая печенька при game_over
+            text = "🥠"
+        else:  # Закрытая ячейка в процессе игры
+            text = "⬜️"
+        row.append(InlineKeyboardButton(text, callback_data=callbacks[x]))
+    return tuple(row)
+
+@lru_cache(maxsize=256)
+def _claim_row(reward: int) -> Tuple[InlineKeyboardButton, ...]:
+    return (InlineKeyboardButton(
+        f"💰 Забрать приз ({reward} токенов)",
+        callback_data="cookie_claim"
+    ),)
+
+SessionKey = Tuple[int, int]
+
+class SessionStore:
+    """
+    Хранилище активных игр (chat_id, message_id) -> game
+    Ограничено по числу сессий (LRU) и по времени простоя. Вытесненные
+    игры копятся до следующей очистки, где передаются в on_evict
+    """
+
+    def __init__(self, max_sessions: int = COOKIE_MAX_SESSIONS, idle_ttl: float = COOKIE_IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.on_evict: Optional[Callable[[SessionKey, CookieGame], Awaitable[None]]] = None
+        # Порядок - от давно не активных к недавним, значение: (game, last_active)
+        self._sessions: "OrderedDict[SessionKey, Tuple[CookieGame, float]]" = OrderedDict()
+        self._evicted: List[Tuple[SessionKey, CookieGame]] = []
+        self.evictions_lru = 0
+        self.evictions_idle = 0
+        self.peak_sessions = 0
+
+    def add(self, key: SessionKey, game: CookieGame):
+        self._sessions[key] = (game, time.monotonic())
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.max_sessions:
+            self._evicted.append(self._sessions.popitem(last=False))
+            self.evictions_lru += 1
+        self.peak_sessions = max(self.peak_sessions, len(self._sessions))
+
+    def get(self, key: SessionKey) -> Optional[CookieGame]:
+        entry = self._sessions.get(key)
+        if entry is None:
+            return None
+        # Обращение продлевает жизнь сессии
+        self._sessions[key] = (entry[0], time.monotonic())
+        self._sessions.move_to_end(key)
+        return entry[0]
+
+    def remove(self, key: SessionKey):
+        self._sessions.pop(key, None)
+
+    def __contains__(self, key: SessionKey) -> bool:
+        return key in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def collect_idle(self) -> List[Tuple[SessionKey, CookieGame]]:
+        """Забирает простаивающие и вытесненные по лимиту игры"""
+        deadline = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            key, (game, last_active) = next(iter(self._sessions.items()))
+            if last_active > deadline:
+                break
+            del self._sessions[key]
+            self._evicted.append((key, (game, last_active)))
+            self.evictions_idle += 1
+        evicted = [(key, game) for key, (game, _) in self._evicted]
+        self._evicted = []
+        return evicted
+
+    async def sweep(self):
+        """Закрывает вытесненные игры через on_evict"""
+        for key, game in self.collect_idle():
+            if self.on_evict is None:
+                continue
+            try:
+                await self.on_evict(key, game)
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии вытесненной игры {key}: {e}")
+
+    async def close_all(self):
+        """Закрывает все активные игры через on_evict (при остановке бота)"""
+        self._evicted.extend(self._sessions.items())
+        self._sessions.clear()
+        await self.sweep()
+
+    async def sweep_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.sweep()
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "live_sessions": len(self._sessions),
+            "peak_sessions": self.peak_sessions,
+            "evictions_lru": self.evictions_lru,
+            "evictions_idle": self.evictions_idle,
+        }
 
 # Хранилище активных игр: (chat_id, message_id) -> game
-active_games: Dict[Tuple[int, int], CookieGame] = {}
+active_games = SessionStore()
 
-def start_game(chat_id: int, message_id: int, player_id: int) -> CookieGame:
-    game = CookieGame(player_id=player_id)
-    active_games[(chat_id, message_id)] = game
+def start_game(chat_id: int, message_id: int, player_id: int, bet: int = 0) -> CookieGame:
+    game = CookieGame(player_id=player_id, bet=bet)
+    active_games.add((chat_id, message_id), game)
     return game
 
 def get_game(chat_id: int, message_id: int) -> CookieGame:
     return active_games.get((chat_id, message_id))
 
 def end_game(chat_id: int, message_id: int):
-    if (chat_id, message_id) in active_games:
-        del active_games[(chat_id, message_id)] 
\ No newline at end of file
+    active_games.remove((chat_id, message_id))
@@ -0,0 +1,56 @@
+import heapq
+import time
+from typing import Dict, Hashable, List, Tuple
+
+class CooldownStore:
+    """
+    Хранилище кулдаунов с автоматическим удалением истекших записей
+    Время отсчитывается по time.monotonic(), истекшие ключи вытесняются
+    через кучу сроков, поэтому память пропорциональна числу активных кулдаунов
+    """
+
+    def __init__(self, duration: float):
+        self.duration = duration
+        self._expires: Dict[Hashable, float] = {}
+        self._heap: List[Tuple[float, Hashable]] = []
+
+    def _evict(self, now: float):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires, key = heapq.heappop(heap)
+            # Ключ мог быть перезапущен - удаляем только актуальную запись
+            if self._expires.get(key) == expires:
+                del self._expires[key]
+
+    def remaining(self, key: Hashable) -> float:
+        """Сколько секунд осталось до конца кулдауна (0 - можно действовать)"""
+        now = time.monotonic()
+        self._evict(now)
+        expires = self._expires.get(key)
+        return expires - now if expires is not None else 0.0
+
+    def start(self, key: Hashable, duration: float = None) -> float:
+        """Запускает кулдаун. Возвращает время окончания по настенным часам (для сохранения)"""
+        if duration is None:
+            duration = self.duration
+        now = time.monotonic()
+        self._evict(now)
+        expires = now + duration
+        self._expires[key] = expires
+        heapq.heappush(self._heap, (expires, key))
+        return time.time() + duration
+
+    def cancel(self, key: Hashable):
+        """Снимает кулдаун (запись в куче станет неактуальной и будет пропущена)"""
+        self._expires.pop(key, None)
+
+    def load(self, entries: Dict[Hashable, float]):
+        """Восстанавливает кулдауны из {ключ: время окончания по настенным часам}"""
+        wall_now = time.time()
+        for key, wall_expires in entries.items():
+            if wall_expires > wall_now:
+                self.start(key, wall_expires - wall_now)
+
+    def __len__(self) -> int:
+        self._evict(time.monotonic())
+        return len(self._expires)
@@ -1,144 +1,447 @@
 import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
+from typing import Optional
 
-# Подключение к базе данных
-conn = sqlite3.connect('stats.sqlite', check_same_thread=False)
-cursor = conn.cursor()
+import leaderboard
+import migrations
+from metrics import timed_db
+from config import DB_PATH, DB_PROFILE, DB_PROFILES
+from storage_backend import (
+    REASON_ADJUST,
+    REASON_BET,
+    REASON_WIN,
+    SNAPSHOT_EVERY,
+)
 
+def connect(path: str = DB_PATH, profile: str = DB_PROFILE, read_only: bool = False) -> sqlite3.Connection:
+    """Открывает соединение и применяет PRAGMA выбранного профиля"""
+    if read_only:
+        connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+    else:
+        connection = sqlite3.connect(path, check_same_thread=False)
+        # Действует только для новой пустой базы и до смены journal_mode:
+        # освобождаемые страницы затем возвращает PRAGMA incremental_vacuum
+        connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    for pragma, value in DB_PROFILES[profile].items():
+        # journal_mode хранится в файле базы, читателю его менять нельзя
+        if read_only and pragma == 'journal_mode':
+            continue
+        connection.execute(f'PRAGMA {pragma} = {value}')
+    return connection
+
+def uses_stats_reader(profile: str = DB_PROFILE) -> bool:
+    """Отдельный читатель имеет смысл только в режиме WAL"""
+    return DB_PROFILES[profile].get('journal_mode', '').upper() == 'WAL'
+
+# Подключение к базе данных открывается при первом обращении (open_connection),
+# а не при импорте модуля
+conn: Optional[sqlite3.Connection] = None
+cursor: Optional[sqlite3.Cursor] = None
+# Соединение только для чтения статистики, создается при первом запросе
+_read_conn = None
+# Путь к файлу базы, с которым открыто основное соединение
+_db_path = DB_PATH
+
+# Очередь отложенной записи: изменения копятся в памяти и
+# сбрасываются одной транзакцией по размеру очереди или по времени
+FLUSH_MAX_PENDING = 200  # Максимум записей в очереди до сброса
+FLUSH_INTERVAL = 1.0  # Максимальная задержка записи в секундах
+
+_pending_lock = threading.RLock()
+_pending_users = {}  # user_id -> username
+_pending_chats = set()
+_pending_history = []  # (user_id, chat_id, game_id, points)
+_pending_tokens = defaultdict(int)  # user_id -> суммарное изменение токенов
+_pending_cooldowns = {}  # (scope, key) -> expires_at
+_pending_journal = []  # (user_id, delta, reason, created_at)
+_last_flush = time.monotonic()
+# Выполненные, но не зафиксированные списания: user_id -> сумма
+# (при откате транзакции они переносятся в _pending_tokens)
+_uncommitted_debits = defaultdict(int)
+# В базу пишут несколько процессов (см. sharding.py): списания фиксируются
+# сразу, чтобы не держать блокировку записи до следующего сброса очереди
+shared_writers = False
+
+# Кэш балансов: user_id -> tokens в базе (как их видит это соединение).
+# Незаписанные изменения из _pending_tokens прибавляются при чтении.
+# При shared_writers кэш не используется - баланс меняют и другие процессы
+BALANCE_CACHE_SIZE = 50000
+_balances: "OrderedDict[int, int]" = OrderedDict()
+balance_cache_hits = 0
+balance_cache_misses = 0
+
+def _cached_balance(user_id: int) -> Optional[int]:
+    global balance_cache_hits, balance_cache_misses
+    if shared_writers:
+        return None
+    tokens = _balances.get(user_id)
+    if tokens is None:
+        balance_cache_misses += 1
+        return None
+    balance_cache_hits += 1
+    _balances.move_to_end(user_id)
+    return tokens
+
+def _cache_balance(user_id: int, tokens: int):
+    if shared_writers:
+        return
+    _balances[user_id] = tokens
+    _balances.move_to_end(user_id)
+    if len(_balances) > BALANCE_CACHE_SIZE:
+        _balances.popitem(last=False)
+
+def balance_cache_metrics() -> dict:
+    total = balance_cache_hits + balance_cache_misses
+    return {
+        "size": len(_balances),
+        "hits": balance_cache_hits,
+        "misses": balance_cache_misses,
+        "hit_rate": balance_cache_hits / total if total else 0.0,
+    }
+
+def open_connection(path: str = DB_PATH) -> sqlite3.Connection:
+    """Открывает основное соединение, если оно еще не открыто"""
+    global conn, cursor, _db_path
+    if conn is None:
+        _db_path = path
+        conn = connect(path)
+        # Включаем поддержку внешних ключей
+        conn.execute('PRAGMA foreign_keys = ON')
+        cursor = conn.cursor()
+    return conn
+
+@timed_db
 def init_db():
-    # Включаем поддержку внешних ключей
-    cursor.execute('PRAGMA foreign_keys = ON')
-    
-    # Создаем таблицы в правильном порядке
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT NOT NULL,
-            tokens INTEGER DEFAULT 0
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chats (
-            chat_id INTEGER PRIMARY KEY,
-            chat_name TEXT
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS games (
-            game_id TEXT PRIMARY KEY,
-            game_name TEXT NOT NULL
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS game_history (
-            history_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            chat_id INTEGER,
-            game_id TEXT,
-            points INTEGER,
-            played_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id),
-            FOREIGN KEY (chat_id) REFERENCES chats(chat_id),
-            FOREIGN KEY (game_id) REFERENCES games(game_id)
-        )
-    ''')
-
-    # Проверяем, есть ли колонка tokens в таблице users
-    cursor.execute("PRAGMA table_info(users)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    if 'tokens' not in columns:
-        cursor.execute('ALTER TABLE users ADD COLUMN tokens INTEGER DEFAULT 0')
-
-    # Заполняем справочник игр, игнорируя дубликаты
-    games = [
-        ('dart', 'Дартс'),
-        ('dice', 'Кубики'),
-        ('basketball', 'Баскетбол'),
-        ('football', 'Футбол'),
-        ('slot', 'Слоты'),
-        ('bowling', 'Боулинг')
-    ]
+    open_connection()
+    # Создаем и обновляем схему; при актуальной версии ничего не выполняется
+    migrations.migrate(conn)
+
+def _pending_count() -> int:
+    return (len(_pending_users) + len(_pending_chats) + len(_pending_history)
+            + len(_pending_tokens) + len(_pending_cooldowns) + len(_pending_journal))
+
+def _maybe_flush():
+    """Сбрасывает очередь, если превышен размер или интервал"""
+    if _pending_count() >= FLUSH_MAX_PENDING or time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush_pending()
+
+@timed_db
+def flush_pending():
+    """Записывает все накопленные изменения одной транзакцией"""
+    global _last_flush
+    with _pending_lock:
+        _last_flush = time.monotonic()
+        if not _pending_count() and not _uncommitted_debits:
+            return
+        open_connection()
+        try:
+            if _pending_users:
+                cursor.executemany('''
+                    INSERT INTO users (user_id, username) 
+                    VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET username = excluded.username
+                ''', _pending_users.items())
+            if _pending_chats:
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO chats (chat_id) 
+                    VALUES (?)
+                ''', [(chat_id,) for chat_id in _pending_chats])
+            if _pending_history:
+                cursor.executemany('''
+                    INSERT INTO game_history (user_id, chat_id, game_id, points)
+                    VALUES (?, ?, ?, ?)
+                ''', _pending_history)
+                leaderboard.record_wins(cursor, _pending_history)
+            if _pending_tokens:
+                cursor.executemany(
+                    'UPDATE users SET tokens = tokens + ? WHERE user_id = ?',
+                    [(amount, user_id) for user_id, amount in _pending_tokens.items() if amount]
+                )
+            if _pending_journal:
+                _append_journal(_pending_journal)
+            if _pending_cooldowns:
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO cooldowns (scope, key, expires_at)
+                    VALUES (?, ?, ?)
+                ''', [(scope, key, expires_at) for (scope, key), expires_at in _pending_cooldowns.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Откат отменил и списания try_debit: они остаются в очереди вместе
+            # с записями журнала и повторяются следующим сбросом
+            for user_id, amount in _uncommitted_debits.items():
+                _pending_tokens[user_id] -= amount
+            _uncommitted_debits.clear()
+            # Откат мог затронуть закэшированные балансы
+            _balances.clear()
+            raise
+        for user_id, amount in _pending_tokens.items():
+            if user_id in _balances:
+                _balances[user_id] += amount
+        _uncommitted_debits.clear()
+        _pending_users.clear()
+        _pending_chats.clear()
+        _pending_history.clear()
+        _pending_tokens.clear()
+        _pending_cooldowns.clear()
+        _pending_journal.clear()
+
+def _append_journal(entries):
+    """Дописывает записи журнала и делает снимки балансов (внутри открытой транзакции)"""
+    # Изменение баланса несуществующего пользователя UPDATE пропускает - журнал тоже
     cursor.executemany('''
-        INSERT OR IGNORE INTO games (game_id, game_name) 
-        VALUES (?, ?)
-    ''', games)
-    conn.commit()
+        INSERT INTO token_journal (user_id, delta, reason, created_at)
+        SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?)
+    ''', [(user_id, delta, reason, created_at, user_id) for user_id, delta, reason, created_at in entries])
 
+    # Счетчик записей после последнего снимка берется из базы: он переживает
+    # перезапуск и верен при нескольких процессах-писателях
+    due = []
+    for user_id in {entry[0] for entry in entries}:
+        cursor.execute('''
+            SELECT COUNT(*) FROM token_journal
+            WHERE user_id = ?1 AND entry_id > (
+                SELECT COALESCE(MAX(entry_id), 0) FROM balance_snapshots WHERE user_id = ?1
+            )
+        ''', (user_id,))
+        if cursor.fetchone()[0] >= SNAPSHOT_EVERY:
+            due.append((time.time(), user_id))
+    if due:
+        cursor.executemany('''
+            INSERT OR REPLACE INTO balance_snapshots (user_id, entry_id, balance, taken_at)
+            SELECT u.user_id, MAX(j.entry_id), u.tokens, ?
+            FROM users u JOIN token_journal j ON j.user_id = u.user_id
+            WHERE u.user_id = ?
+        ''', due)
+
+@timed_db
 def ensure_user_exists(user_id: int, username: str):
     """Создает или обновляет пользователя"""
-    cursor.execute('''
-        INSERT INTO users (user_id, username) 
-        VALUES (?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET username = ?
-    ''', (user_id, username, username))
-    conn.commit()
+    with _pending_lock:
+        _pending_users[user_id] = username
+        _maybe_flush()
 
+@timed_db
 def ensure_chat_exists(chat_id: int):
     """Создает чат если не существует"""
-    cursor.execute('''
-        INSERT OR IGNORE INTO chats (chat_id) 
-        VALUES (?)
-    ''', (chat_id,))
-    conn.commit()
+    with _pending_lock:
+        _pending_chats.add(chat_id)
+        _maybe_flush()
 
+@timed_db
 def add_game_record(user_id: int, username: str, chat_id: int, game_id: str, points: int):
     """Добавляет запись об игре"""
-    ensure_user_exists(user_id, username)
-    ensure_chat_exists(chat_id)
-    
-    cursor.execute('''
-        INSERT INTO game_history (user_id, chat_id, game_id, points)
-        VALUES (?, ?, ?, ?)
-    ''', (user_id, chat_id, game_id, points))
-    conn.commit()
-
-def get_stats(period: str, chat_id: int):
-    """Получает статистику за период"""
-    time_filters = {
-        'hour': "AND played_at >= datetime('now', '-1 hour')",
-        'day': "AND played_at >= datetime('now', '-1 day')",
-        'week': "AND played_at >= datetime('now', '-7 days')",
-        'month': "AND played_at >= datetime('now', '-30 days')",
-        'all': ""
-    }
-    
-    time_filter = time_filters.get(period, "")
-    
-    query = f'''
-        SELECT 
-            u.username,
-            u.tokens as total_points
-        FROM users u
-        WHERE EXISTS (
-            SELECT 1 FROM game_history h 
-            WHERE h.user_id = u.user_id 
-            AND h.chat_id = ?
-            {time_filter}
-        )
-        AND u.tokens > 0
-        ORDER BY u.tokens DESC
-    '''
-    
-    cursor.execute(query, (chat_id,))
-    return cursor.fetchall()
+    with _pending_lock:
+        _pending_users[user_id] = username
+        _pending_chats.add(chat_id)
+        _pending_history.append((user_id, chat_id, game_id, points))
+        _maybe_flush()
+
+@timed_db
+def get_stats(period: str, chat_id: int, limit: int = None, offset: int = 0):
+    """
+    Получает статистику за период из агрегатов leaderboard
+    В режиме WAL читает через отдельное соединение и не ждет писателя,
+    поэтому очередь записи нужно сбросить заранее (см. storage.get_stats)
+    """
+    global _read_conn
+    if uses_stats_reader():
+        if _read_conn is None:
+            _read_conn = connect(_db_path, read_only=True)
+        return leaderboard.query_top(_read_conn.cursor(), period, chat_id, limit, offset)
+
+    with _pending_lock:
+        # Статистика должна видеть все накопленные изменения
+        flush_pending()
+        open_connection()
+        return leaderboard.query_top(cursor, period, chat_id, limit, offset)
 
+@timed_db
 def update_player(user_id: int, username: str, points: int, chat_id: int, game_id: str = None):
     """Обновляет статистику игрока"""
     if points > 0:  # Записываем только выигрыши
-        add_game_record(user_id, username, chat_id, game_id, points)
-        update_user_tokens(user_id, points)  # Добавляем выигрыш к токенам
+        with _pending_lock:
+            add_game_record(user_id, username, chat_id, game_id, points)
+            update_user_tokens(user_id, points, REASON_WIN)  # Добавляем выигрыш к токенам
 
+@timed_db
 def get_user_tokens(user_id: int) -> int:
-    """Получает количество токенов пользователя"""
-    cursor.execute('SELECT tokens FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    return result[0] if result else 0
+    """Получает количество токенов пользователя с учетом незаписанных изменений"""
+    with _pending_lock:
+        tokens = _cached_balance(user_id)
+        if tokens is None:
+            open_connection()
+            cursor.execute('SELECT tokens FROM users WHERE user_id = ?', (user_id,))
+            result = cursor.fetchone()
+            if result is None and user_id not in _pending_users:
+                return 0
+            tokens = result[0] if result else 0
+            if result is not None:
+                _cache_balance(user_id, tokens)
+        return tokens + _pending_tokens.get(user_id, 0)
 
-def update_user_tokens(user_id: int, amount: int):
+@timed_db
+def try_debit(user_id: int, amount: int, reason: str = REASON_BET) -> Optional[int]:
+    """
+    Списывает токены одним условным UPDATE, если их достаточно
+    Если баланс есть в кэше, проверка идет в памяти, а списание
+    уходит в очередь записи. Возвращает новый баланс или None
+    """
+    with _pending_lock:
+        tokens = _cached_balance(user_id)
+        if tokens is not None:
+            balance = tokens + _pending_tokens.get(user_id, 0)
+            if balance < amount:
+                return None
+            _pending_tokens[user_id] -= amount
+            _pending_journal.append((user_id, -amount, reason, time.time()))
+            _maybe_flush()
+            return balance - amount
+
+        # Пользователь еще не записан в БД - UPDATE его не найдет
+        if user_id in _pending_users:
+            flush_pending()
+        open_connection()
+        pending = _pending_tokens.get(user_id, 0)
+        rows = cursor.execute('''
+            UPDATE users SET tokens = tokens - ?
+            WHERE user_id = ? AND tokens + ? >= ?
+            RETURNING tokens
+        ''', (amount, user_id, pending, amount)).fetchall()
+        if not rows:
+            return None
+        _cache_balance(user_id, rows[0][0])
+        entry = (user_id, -amount, reason, time.time())
+        if shared_writers:
+            # Запись журнала фиксируется в одной транзакции со списанием
+            _append_journal([entry])
+            conn.commit()
+        else:
+            # Фиксируется вместе со следующим сбросом очереди
+            _pending_journal.append(entry)
+            _uncommitted_debits[user_id] += amount
+            _maybe_flush()
+        return rows[0][0] + pending
+
+@timed_db
+def update_user_tokens(user_id: int, amount: int, reason: str = REASON_ADJUST):
     """Обновляет количество токенов пользователя"""
-    cursor.execute('UPDATE users SET tokens = tokens + ? WHERE user_id = ?', (amount, user_id))
-    conn.commit()
\ No newline at end of file
+    with _pending_lock:
+        _pending_tokens[user_id] += amount
+        _pending_journal.append((user_id, amount, reason, time.time()))
+        _maybe_flush()
+
+@timed_db
+def save_cooldown(scope: str, key: int, expires_at: float):
+    """Сохраняет окончание кулдауна (время по настенным часам)"""
+    with _pending_lock:
+        _pending_cooldowns[(scope, key)] = expires_at
+        _maybe_flush()
+
+@timed_db
+def load_cooldowns(scope: str) -> dict:
+    """Загружает активные кулдауны {key: expires_at}, удаляя истекшие"""
+    now = time.time()
+    with _pending_lock:
+        flush_pending()
+        open_connection()
+        cursor.execute('DELETE FROM cooldowns WHERE scope = ? AND expires_at <= ?', (scope, now))
+        conn.commit()
+        cursor.execute('SELECT key, expires_at FROM cooldowns WHERE scope = ?', (scope,))
+        return dict(cursor.fetchall())
+
+@timed_db
+def claim_cooldown(scope: str, key: int, duration: float) -> float:
+    """
+    Атомарно запускает кулдаун, если он истек (для нескольких процессов, см. sharding.py)
+    Фиксируется сразу. Возвращает 0 или сколько секунд осталось до конца чужого кулдауна
+    """
+    now = time.time()
+    with _pending_lock:
+        flush_pending()
+        open_connection()
+        try:
+            claimed = cursor.execute('''
+                INSERT INTO cooldowns (scope, key, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(scope, key) DO UPDATE SET expires_at = excluded.expires_at
+                WHERE cooldowns.expires_at <= ?
+                RETURNING expires_at
+            ''', (scope, key, now + duration, now)).fetchall()
+            if not claimed:
+                cursor.execute('SELECT expires_at FROM cooldowns WHERE scope = ? AND key = ?', (scope, key))
+                expires_at = cursor.fetchone()[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return 0.0 if claimed else max(expires_at - now, 0.0)
+
+@timed_db
+def release_cooldown(scope: str, key: int):
+    """Снимает кулдаун, запущенный claim_cooldown"""
+    with _pending_lock:
+        flush_pending()
+        open_connection()
+        cursor.execute('DELETE FROM cooldowns WHERE scope = ? AND key = ?', (scope, key))
+        conn.commit()
+
+@timed_db
+def get_balance_at(user_id: int, at: float = None) -> int:
+    """
+    Восстанавливает баланс по журналу: последний снимок до момента at
+    плюс изменения после него. Без at - текущий записанный баланс
+    """
+    if at is None:
+        at = time.time()
+    with _pending_lock:
+        flush_pending()
+        open_connection()
+        cursor.execute('''
+            SELECT entry_id, balance FROM balance_snapshots
+            WHERE user_id = ? AND taken_at <= ?
+            ORDER BY entry_id DESC LIMIT 1
+        ''', (user_id, at))
+        snapshot = cursor.fetchone()
+        entry_id, balance = snapshot if snapshot else (0, 0)
+        cursor.execute('''
+            SELECT COALESCE(SUM(delta), 0) FROM token_journal
+            WHERE user_id = ? AND entry_id > ? AND created_at <= ?
+        ''', (user_id, entry_id, at))
+        return balance + cursor.fetchone()[0]
+
+@timed_db
+def get_stats_at(chat_id: int, at: float, limit: int = None, offset: int = 0):
+    """Лидерборд чата на момент at по снимкам балансов и журналу"""
+    with _pending_lock:
+        flush_pending()
+        open_connection()
+        return leaderboard.query_top_at(cursor, chat_id, at, limit, offset)
+
+@timed_db
+def run_in_transaction(func, *args):
+    """
+    Выполняет func(cursor, *args) в отдельной транзакции после сброса очереди записи
+    Для фоновых задач обслуживания: транзакция должна быть короткой
+    """
+    with _pending_lock:
+        flush_pending()
+        open_connection()
+        try:
+            result = func(cursor, *args)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return result
+
+@timed_db
+def incremental_vacuum(pages: int):
+    """Возвращает файловой системе до pages свободных страниц (при auto_vacuum=INCREMENTAL)"""
+    with _pending_lock:
+        flush_pending()
+        open_connection()
+        if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
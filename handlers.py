@@ -1,16 +1,35 @@
-import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import (
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
 )
-from datetime import datetime, timedelta
-from collections import defaultdict
 
-from config import logger
-from database import init_db, update_player, get_stats, get_user_tokens, update_user_tokens, ensure_user_exists
-from cookie_game import start_game, get_game, end_game
+import time
+
+import metrics
+from config import COOKIE_EVICTION_POLICY, STATS_PAGE_SIZE, logger
+from metrics import timed_handler
+from cooldowns import CooldownStore
+from storage_backend import REASON_COOKIE, REASON_FREE, REASON_REFUND
+from storage import (
+    update_player,
+    get_stats,
+    get_user_tokens,
+    update_user_tokens,
+    ensure_user_exists,
+    try_debit,
+    save_cooldown,
+    load_cooldowns,
+    claim_cooldown,
+    release_cooldown,
+    user_lock,
+)
+from cookie_game import start_game, get_game, end_game, active_games
+from outcomes import BET_AMOUNT, EMOJI, settle
+from settlement import scheduler as settlement_scheduler
+from stats_view import render_page, stats_cache
 
 # Словарь с временем ожидания для каждой анимации
 ANIMATION_DURATIONS = {
@@ -22,61 +41,58 @@ ANIMATION_DURATIONS = {
     "bowling": 4.0     
 }
 
-POINTS = {
-    "dart": 1200,      # Попадание в центр
-    "dice": 600,       # Базовое значение для кубиков (будет умножаться на выпавшее число)
-    "basketball": 400, # Попадание в корзину
-    "football": 300,   # Гол
-    "bowling": 600,    # Страйк
-    "slot": {
-        1: ("🍫🍫🍫", 2000),  # Три бара
-        43: ("🍋🍋🍋", 3000), # Три лимона
-        22: ("🍒🍒🍒", 4000), # Три вишни
-        64: ("7⃣7⃣7⃣", 7000)  # 777
-    }
-}
-    
-# Словарь для хранения времени последней игры для каждого пользователя и типа игры
-# Формат: {user_id: {game_type: timestamp}}
-last_game_timestamps = defaultdict(lambda: defaultdict(float))
+# Кулдауны игр, ключ: (user_id, game_type)
 COOLDOWN_SECONDS = 10
+game_cooldowns = CooldownStore(COOLDOWN_SECONDS)
 
-# Константа для ставки
-BET_AMOUNT = 300
-
-# Словарь для хранения времени последнего получения токенов
-last_token_claims = defaultdict(float)
+# Кулдауны получения токенов, ключ: user_id
+# Сохраняются в БД и восстанавливаются при запуске (load_token_cooldowns)
 TOKEN_COOLDOWN = 7200  # 2 часа в секундах
+TOKEN_COOLDOWN_SCOPE = "free_tokens"
+token_cooldowns = CooldownStore(TOKEN_COOLDOWN)
+
+# При шардировании (sharding.py) пользователь пишет в чаты разных воркеров:
+# кулдауны дополнительно занимаются в общем хранилище
+shared_cooldowns = False
+
+async def load_token_cooldowns():
+    token_cooldowns.load(await load_cooldowns(TOKEN_COOLDOWN_SCOPE))
 
 async def check_cooldown(user_id: int, game_type: str) -> bool:
     """
     Проверяет, прошло ли достаточно времени с последней игры данного типа
     Возвращает True если можно играть, False если нужно подождать
     """
-    last_timestamp = last_game_timestamps[user_id][game_type]
-    if last_timestamp == 0:
+    if game_cooldowns.remaining((user_id, game_type)) == 0:
         return True
-        
-    time_passed = datetime.now().timestamp() - last_timestamp
-    return time_passed >= COOLDOWN_SECONDS
+    metrics.counter("cooldown_rejections_total", scope=game_type).inc()
+    return False
 
 async def check_token_cooldown(user_id: int) -> tuple[bool, int]:
     """
     Проверяет, прошло ли достаточно времени с последнего получения токенов
     Возвращает (можно_получить, оставшееся_время)
     """
-    last_claim = last_token_claims[user_id]
-    if last_claim == 0:
-        return True, 0
-        
-    time_passed = datetime.now().timestamp() - last_claim
-    if time_passed >= TOKEN_COOLDOWN:
+    remaining = token_cooldowns.remaining(user_id)
+    if remaining == 0:
         return True, 0
     else:
-        remaining = TOKEN_COOLDOWN - time_passed
+        metrics.counter("cooldown_rejections_total", scope=TOKEN_COOLDOWN_SCOPE).inc()
         return False, int(remaining)
 
+async def claim_shared_cooldown(store: CooldownStore, key, scope: str, user_id: int) -> float:
+    """
+    Занимает кулдаун в общем хранилище. Возвращает 0, если занят этим запросом,
+    иначе сколько секунд осталось; чужой кулдаун переносится в store
+    """
+    remaining = await claim_cooldown(scope, user_id, store.duration)
+    if remaining:
+        store.start(key, remaining)
+        metrics.counter("cooldown_rejections_total", scope=scope).inc()
+    return remaining
+
 # Функция для старта бота
+@timed_handler
 async def start(update: Update, context):
     logger.info("Команда /start получена")
     keyboard = [
@@ -97,29 +113,50 @@ async def handle_game(update: Update, context: ContextTypes.DEFAULT_TYPE, game_t
     user_id = update.message.from_user.id if update.message else update.callback_query.from_user.id
     username = update.message.from_user.username or "Unknown" if update.message else update.callback_query.from_user.username or "Unknown"
 
-    # Проверяем наличие токенов
-    current_tokens = get_user_tokens(user_id)
-    if current_tokens < BET_AMOUNT:
-        message = f"❌ Недостаточно токенов! Необходимо: {BET_AMOUNT}, у вас: {current_tokens}\nИспользуйте команду /tokens чтобы получить токены"
+    async def reply_cooldown(remaining_time: float):
+        cooldown_message = f"⏳ Подождите {int(remaining_time)} секунд перед следующей игрой в {game_type.capitalize()}"
+        if query:
+            await query.answer(text=cooldown_message, show_alert=True)
+        else:
+            await update.message.reply_text(cooldown_message)
+
+    # Кулдаун проверяется в памяти до любых обращений к БД
+    if not await check_cooldown(user_id, game_type):
+        await reply_cooldown(game_cooldowns.remaining((user_id, game_type)))
+        return
+
+    # При переполненной очереди расчета не принимаем новые броски
+    if settlement_scheduler.is_full:
+        message = "⏳ Слишком много игр одновременно, попробуйте через несколько секунд"
         if query:
             await query.answer(text=message, show_alert=True)
         else:
             await update.message.reply_text(message)
         return
 
-    # Списываем ставку
-    update_user_tokens(user_id, -BET_AMOUNT)
+    # Кулдаун занимаем сразу: параллельный запрос той же игры не пройдет проверку,
+    # пока идет списание
+    game_cooldowns.start((user_id, game_type))
+    if shared_cooldowns:
+        remaining_time = await claim_shared_cooldown(game_cooldowns, (user_id, game_type), game_type, user_id)
+        if remaining_time:
+            await reply_cooldown(remaining_time)
+            return
 
-    # Проверяем кулдаун
-    if not await check_cooldown(user_id, game_type):
-        remaining_time = COOLDOWN_SECONDS - (datetime.now().timestamp() - last_game_timestamps[user_id][game_type])
-        cooldown_message = f"⏳ Подождите {int(remaining_time)} секунд перед следующей игрой в {game_type.capitalize()}"
+    # Проверяем наличие токенов и списываем ставку одним запросом
+    if await try_debit(user_id, BET_AMOUNT) is None:
+        game_cooldowns.cancel((user_id, game_type))
+        if shared_cooldowns:
+            await release_cooldown(game_type, user_id)
+        current_tokens = await get_user_tokens(user_id)
+        message = f"❌ Недостаточно токенов! Необходимо: {BET_AMOUNT}, у вас: {current_tokens}\nИспользуйте команду /tokens чтобы получить токены"
         if query:
-            await query.answer(text=cooldown_message, show_alert=True)
-            return
+            await query.answer(text=message, show_alert=True)
         else:
-            await update.message.reply_text(cooldown_message)
-            return
+            await update.message.reply_text(message)
+        return
+    metrics.counter("bets_total", game=game_type).inc()
+    metrics.counter("bet_tokens_total", game=game_type).inc(BET_AMOUNT)
 
     if query:
         await query.answer()
@@ -127,165 +164,147 @@ async def handle_game(update: Update, context: ContextTypes.DEFAULT_TYPE, game_t
     else:
         reply_to_message_id = update.message.message_id
 
-    emoji_type = {
-        "dart": "🎯",
-        "dice": "🎲",
-        "basketball": "🏀",
-        "football": "⚽️",
-        "slot": "🎰",
-        "bowling": "🎳"
-    }.get(game_type)
+    emoji_type = EMOJI.get(game_type)
 
     async def process_game_result():
-        nonlocal points, interpreted_result
-        # Ждём завершения анимации
-        wait_time = ANIMATION_DURATIONS.get(game_type, 3) + 0.2
-        await asyncio.sleep(wait_time)
+        started = time.perf_counter()
+        if game_type == "dice":
+            outcome = settle(game_type, first_dice.dice.value, second_dice.dice.value)
+        else:
+            outcome = settle(game_type, dice_message.dice.value)
 
-        try:
-            if game_type == "dice":
-                result_1 = first_dice.dice.value
-                result_2 = second_dice.dice.value
-                if result_1 == result_2:
-                    multiplier = result_1
-                    points = POINTS[game_type] * multiplier
-                    interpreted_result = f"🎲 Выпало: {result_1} и {result_2}. 🎉 Вы выиграли! (x{multiplier})"
-                else:
-                    interpreted_result = f"🎲 Выпало: {result_1} и {result_2}. ❌ Вы проиграли."
-                    points = 0
-            else:
-                result_1 = dice_message.dice.value
-                if game_type == "dart":
-                    interpreted_result = "🎯 Попал в центр!" if result_1 == 6 else "❌ Не попал в центр."
-                    points = POINTS[game_type] if result_1 == 6 else 0
-                elif game_type == "basketball":
-                    interpreted_result = "🏀 Попал в корзину!" if result_1 in [4, 5] else "❌ Не попал в корзину."
-                    points = POINTS[game_type] if result_1 in [4, 5] else 0
-                elif game_type == "football":
-                    interpreted_result = "⚽️ Попал в ворота!" if result_1 in [3, 4, 5] else "❌ Не попал в ворота."
-                    points = POINTS[game_type] if result_1 in [3, 4, 5] else 0
-                elif game_type == "bowling":
-                    interpreted_result = "🎳 Страйк! 🎉 Все кегли сбиты!" if result_1 == 6 else "❌ Неудача. Попробуйте еще раз."
-                    points = POINTS[game_type] if result_1 == 6 else 0
-                elif game_type == "slot":
-                    slot_result = POINTS[game_type].get(result_1)
-                    if slot_result:
-                        winning_symbol, points = slot_result
-                        interpreted_result = f"🎰 Выпало: {winning_symbol} 🎉 Вы выиграли!"
-                    else:
-                        interpreted_result = "❌ Вы проиграли."
-                        points = 0
-
-            # Отправляем сообщение с результатом
-            if query:
-                message_text = f"Вы выбрали игру {game_type.capitalize()}.\n{interpreted_result}"
-                if points > 0:
-                    message_text += f"\n💰 Выигрыш: {points} токенов"
-                await query.edit_message_text(text=message_text)
-            else:
-                message_text = f"Вы выбрали игру {game_type.capitalize()}.\n{interpreted_result}"
-                if points > 0:
-                    message_text += f" Выигрыш: {points} токенов"
-                await update.message.reply_text(text=message_text)
-
-            # Обновляем статистику игрока
-            update_player(user_id, username, points, chat_id, game_type)
-            
-        except Exception as e:
-            logger.error(f"Ошибка при обработке результата: {e}")
+        # Сначала начисляем выигрыш (запись в БД - одним сбросом на пачку):
+        # результат не должен потеряться, если сообщение не удастся отправить
+        await update_player(user_id, username, outcome.points, chat_id, game_type)
+        if outcome.points > 0:
+            stats_cache.invalidate(chat_id)
+            metrics.counter("wins_total", game=game_type).inc()
+            metrics.counter("payout_tokens_total", game=game_type).inc(outcome.points)
 
-    # Отправляем эмодзи сразу
-    points = 0
-    interpreted_result = ""
-    
-    if game_type == "dice":
-        first_dice = await context.bot.send_dice(chat_id=chat_id, emoji=emoji_type)
-        second_dice = await context.bot.send_dice(chat_id=chat_id, emoji=emoji_type)
-    else:
-        dice_message = await context.bot.send_dice(chat_id=chat_id, emoji=emoji_type)
-
-    # Запускаем обработку результата асинхронно без ожидания завершения
-    asyncio.create_task(process_game_result())
+        # Отправляем сообщение с результатом
+        if query:
+            await query.edit_message_text(text=outcome.edit_text)
+        else:
+            await update.message.reply_text(text=outcome.reply_text)
+        metrics.histogram("settlement_seconds", game=game_type).observe(time.perf_counter() - started)
 
-    # Обновляем время последней игры
-    last_game_timestamps[user_id][game_type] = datetime.now().timestamp()
+    # Отправляем эмодзи сразу
+    try:
+        if game_type == "dice":
+            first_dice = await context.bot.send_dice(chat_id=chat_id, emoji=emoji_type)
+            second_dice = await context.bot.send_dice(chat_id=chat_id, emoji=emoji_type)
+        else:
+            dice_message = await context.bot.send_dice(chat_id=chat_id, emoji=emoji_type)
+    except TelegramError:
+        # Бросок не состоялся (например, переполнена очередь отправки в чат) - возвращаем ставку
+        await update_user_tokens(user_id, BET_AMOUNT, REASON_REFUND)
+        game_cooldowns.cancel((user_id, game_type))
+        if shared_cooldowns:
+            await release_cooldown(game_type, user_id)
+        raise
+
+    # Результат рассчитывается после завершения анимации
+    settlement_scheduler.schedule(ANIMATION_DURATIONS.get(game_type, 3) + 0.2, process_game_result)
 
 # Обработчики команд
+@timed_handler
 async def dart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await handle_game(update, context, "dart")
 
+@timed_handler
 async def dice_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await handle_game(update, context, "dice")
 
+@timed_handler
 async def basketball_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await handle_game(update, context, "basketball")
 
+@timed_handler
 async def football_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await handle_game(update, context, "football")
 
+@timed_handler
 async def slot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await handle_game(update, context, "slot")
 
+@timed_handler
 async def bowling_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await handle_game(update, context, "bowling")
 
 # Обработчик выбора игры через кнопки
+@timed_handler
 async def game_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     game_type = query.data
     await handle_game(update, context, game_type)
 
 # Команды для статистики
-async def stats_all(update: Update, context):
-    chat_id = update.message.chat_id
-    stats = get_stats('all', chat_id)
-    message = "🏆 Статистика за всё время:\n"
-    for idx, (username, points) in enumerate(stats, start=1):
-        message += f"{idx}. @{username}: {points} очков\n"
-    await update.message.reply_text(message)
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE, period: str, page: int = 0):
+    query = update.callback_query
+    chat_id = query.message.chat_id if query else update.message.chat_id
 
-async def stats_month(update: Update, context):
-    chat_id = update.message.chat_id
-    stats = get_stats('month', chat_id)
-    message = "📅(30) Статистика за месяц:\n"
-    for idx, (username, points) in enumerate(stats, start=1):
-        message += f"{idx}. @{username}: {points} очков\n"
-    await update.message.reply_text(message)
+    cached = stats_cache.get(chat_id, period, page)
+    if cached is None:
+        # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+        rows = await get_stats(period, chat_id, STATS_PAGE_SIZE + 1, page * STATS_PAGE_SIZE)
+        cached = render_page(period, rows[:STATS_PAGE_SIZE], page, len(rows) > STATS_PAGE_SIZE)
+        stats_cache.put(chat_id, period, page, cached)
+    text, reply_markup = cached
 
-async def stats_week(update: Update, context):
-    chat_id = update.message.chat_id
-    stats = get_stats('week', chat_id)
-    message = "📅(7) Статистика за неделю:\n"
-    for idx, (username, points) in enumerate(stats, start=1):
-        message += f"{idx}. @{username}: {points} очков\n"
-    await update.message.reply_text(message)
+    if query:
+        await query.answer()
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup)
 
-async def stats_day(update: Update, context):
-    chat_id = update.message.chat_id
-    stats = get_stats('day', chat_id)
-    message = "📅(1) Статистика за день:\n"
-    for idx, (username, points) in enumerate(stats, start=1):
-        message += f"{idx}. @{username}: {points} очков\n"
-    await update.message.reply_text(message)
+@timed_handler
+async def stats_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await stats_command(update, context, "all")
 
-async def stats_hour(update: Update, context):
-    chat_id = update.message.chat_id
-    stats = get_stats('hour', chat_id)
-    message = "⏰ Статистика за час:\n"
-    for idx, (username, points) in enumerate(stats, start=1):
-        message += f"{idx}. @{username}: {points} очков\n"
-    await update.message.reply_text(message)
+@timed_handler
+async def stats_month(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await stats_command(update, context, "month")
+
+@timed_handler
+async def stats_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await stats_command(update, context, "week")
+
+@timed_handler
+async def stats_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await stats_command(update, context, "day")
+
+@timed_handler
+async def stats_hour(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await stats_command(update, context, "hour")
 
+# Обработчик переключения страниц статистики: stats_{period}_{page}
+@timed_handler
+async def stats_page_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _, period, page = update.callback_query.data.split('_')
+    await stats_command(update, context, period, int(page))
+
+@timed_handler
 async def claim_tokens_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     username = update.message.from_user.username or "Unknown"
     
-    can_claim, remaining_seconds = await check_token_cooldown(user_id)
-    
+    # Два одновременных /free_tokens не должны начислить токены дважды
+    async with user_lock(user_id):
+        can_claim, remaining_seconds = await check_token_cooldown(user_id)
+        if can_claim and shared_cooldowns:
+            # Кулдаун в хранилище занимается до начисления - другой воркер его уже не получит
+            remaining = await claim_shared_cooldown(token_cooldowns, user_id, TOKEN_COOLDOWN_SCOPE, user_id)
+            can_claim, remaining_seconds = not remaining, int(remaining)
+
+        if can_claim:
+            await ensure_user_exists(user_id, username)
+            await update_user_tokens(user_id, 10000, REASON_FREE)
+            stats_cache.invalidate(update.message.chat_id)
+            expires_at = token_cooldowns.start(user_id)
+            if not shared_cooldowns:
+                await save_cooldown(TOKEN_COOLDOWN_SCOPE, user_id, expires_at)
+
     if can_claim:
-        ensure_user_exists(user_id, username)
-        update_user_tokens(user_id, 10000)
-        last_token_claims[user_id] = datetime.now().timestamp()
         await update.message.reply_text("💰 Вы получили 10000 токенов!")
     else:
         hours = remaining_seconds // 3600
@@ -294,36 +313,62 @@ async def claim_tokens_command(update: Update, context: ContextTypes.DEFAULT_TYP
             f"⏳ Следующие токены будут доступны через {hours}ч {minutes}мин"
         )
 
+@timed_handler
 async def cookie_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     chat_id = update.message.chat_id
     
-    # Проверяем наличие токенов
-    current_tokens = get_user_tokens(user_id)
-    if current_tokens < BET_AMOUNT:
+    # Проверяем наличие токенов и списываем ставку одним запросом
+    if await try_debit(user_id, BET_AMOUNT) is None:
+        current_tokens = await get_user_tokens(user_id)
         await update.message.reply_text(
             f"❌ Недостаточно токенов! Необходимо: {BET_AMOUNT}, у вас: {current_tokens}\n"
             "Используйте команду /free_tokens чтобы получить токены"
         )
         return
-
-    # Списываем ставку
-    update_user_tokens(user_id, -BET_AMOUNT)
-    
-    # Отправляем сообщение и сохраняем его ID
-    message = await update.message.reply_text(
-        "🍪 Игра 'Печенька' началась!\nНайдите печеньки и не нарвитесь на бомбы!"
-    )
+    metrics.counter("bets_total", game="cookie").inc()
+    metrics.counter("bet_tokens_total", game="cookie").inc(BET_AMOUNT)
     
-    # Начинаем новую игру с сохранением message_id
-    game = start_game(chat_id, message.message_id, user_id)
-    
-    # Обновляем сообщение с клавиатурой
-    await message.edit_text(
-        f"🍪 Игра 'Печенька' началась!\nИгрок: @{update.message.from_user.username}\nНайдите печеньки и не нарвитесь на бомбы!",
-        reply_markup=game.get_keyboard()
-    )
+    message = None
+    try:
+        # Отправляем сообщение и сохраняем его ID
+        message = await update.message.reply_text(
+            "🍪 Игра 'Печенька' началась!\nНайдите печеньки и не нарвитесь на бомбы!"
+        )
+
+        # Начинаем новую игру с сохранением message_id
+        game = start_game(chat_id, message.message_id, user_id, bet=BET_AMOUNT)
+
+        # Обновляем сообщение с клавиатурой
+        await message.edit_text(
+            f"🍪 Игра 'Печенька' началась!\nИгрок: @{update.message.from_user.username}\nНайдите печеньки и не нарвитесь на бомбы!",
+            reply_markup=game.get_keyboard()
+        )
+    except TelegramError:
+        # Поле не дошло до игрока (например, переполнена очередь отправки в чат) - возвращаем ставку
+        if message is not None:
+            end_game(chat_id, message.message_id)
+        await update_user_tokens(user_id, BET_AMOUNT, REASON_REFUND)
+        raise
+
+async def settle_evicted_game(key, game):
+    """Закрывает брошенную или прерванную остановкой игру "Печенька" по политике COOKIE_EVICTION_POLICY"""
+    if game.game_over:
+        return
+    if COOKIE_EVICTION_POLICY == "refund":
+        amount, reason = game.bet, REASON_REFUND
+    elif COOKIE_EVICTION_POLICY == "settle":
+        amount, reason = game.current_reward, REASON_COOKIE
+    else:
+        amount = 0
+    if amount > 0:
+        await update_user_tokens(game.player_id, amount, reason)
+        stats_cache.invalidate(key[0])
+    logger.info(f"Игра {key} закрыта без игрока ({COOKIE_EVICTION_POLICY}), начислено: {amount}")
 
+active_games.on_evict = settle_evicted_game
+
+@timed_handler
 async def cookie_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -348,20 +393,37 @@ async def cookie_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     data = query.data
     if data == "cookie_claim":
-        reward = game.current_reward
+        # Повторное нажатие "Забрать" не должно выплатить приз дважды
+        async with user_lock(user_id):
+            if get_game(chat_id, message_id) is not game:
+                return
+            reward = game.current_reward
+            if reward > 0:
+                await update_user_tokens(user_id, reward, REASON_COOKIE)
+                stats_cache.invalidate(chat_id)
+                end_game(chat_id, message_id)
+                metrics.counter("wins_total", game="cookie").inc()
+                metrics.counter("payout_tokens_total", game="cookie").inc(reward)
         if reward > 0:
-            update_user_tokens(user_id, reward)
             await query.edit_message_text(
                 f"🎉 Поздравляем!\nИгрок @{query.from_user.username} забрал выигрыш: {reward} токенов!",
                 reply_markup=None
             )
-            end_game(chat_id, message_id)
         else:
             await query.answer("Нечего забирать! Откройте хотя бы одну печеньку.")
             return
     else:
-        _, x, y = data.split('_')
-        x, y = int(x), int(y)
+        # callback_data приходит от клиента и может быть подделана
+        try:
+            _, x, y = data.split('_')
+            x, y = int(x), int(y)
+        except ValueError:
+            return
+        if not game.contains(x, y):
+            return
+        # Повторное нажатие на открытую ячейку ничего не меняет - не редактируем сообщение
+        if game.is_opened(x, y):
+            return
         is_bomb, reward = game.open_cell(x, y)
         
         if is_bomb:
@@ -0,0 +1,143 @@
+import time
+from collections import defaultdict
+
+# Агрегаты выигрышей по чатам, поддерживаемые инкрементально при записи
+# истории. Окна статистики считаются по часовым и дневным корзинам,
+# поэтому границы окна округляются до начала корзины.
+HOUR = 3600
+DAY = 86400
+
+# period -> (таблица корзин, размер корзины, длина окна в секундах)
+WINDOWS = {
+    'hour': ('leaderboard_hourly', HOUR, HOUR),
+    'day': ('leaderboard_hourly', HOUR, DAY),
+    'week': ('leaderboard_daily', DAY, 7 * DAY),
+    'month': ('leaderboard_daily', DAY, 30 * DAY),
+}
+
+BUCKET_TABLES = (('leaderboard_hourly', HOUR), ('leaderboard_daily', DAY))
+
+def create_tables(cursor):
+    """Создает таблицы агрегатов и заполняет их из истории при первом запуске"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_total (
+            chat_id INTEGER,
+            user_id INTEGER,
+            points INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    for table, _ in BUCKET_TABLES:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                chat_id INTEGER,
+                bucket INTEGER,
+                user_id INTEGER,
+                points INTEGER NOT NULL DEFAULT 0,
+                wins INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (chat_id, bucket, user_id)
+            ) WITHOUT ROWID
+        ''')
+
+    # Перенос уже накопленной истории выполняется один раз
+    cursor.execute('SELECT 1 FROM leaderboard_total LIMIT 1')
+    if cursor.fetchone() is None:
+        cursor.execute('''
+            INSERT INTO leaderboard_total (chat_id, user_id, points, wins)
+            SELECT chat_id, user_id, SUM(points), COUNT(*)
+            FROM game_history
+            GROUP BY chat_id, user_id
+        ''')
+        for table, size in BUCKET_TABLES:
+            cursor.execute(f'''
+                INSERT INTO {table} (chat_id, bucket, user_id, points, wins)
+                SELECT chat_id, CAST(strftime('%s', played_at) AS INTEGER) / {size},
+                       user_id, SUM(points), COUNT(*)
+                FROM game_history
+                GROUP BY 1, 2, 3
+            ''')
+
+def record_wins(cursor, rows, now: float = None):
+    """
+    Добавляет выигрыши в агрегаты
+    rows - записи истории (user_id, chat_id, game_id, points)
+    """
+    if now is None:
+        now = time.time()
+    totals = defaultdict(lambda: [0, 0])
+    for user_id, chat_id, _, points in rows:
+        total = totals[(chat_id, user_id)]
+        total[0] += points
+        total[1] += 1
+
+    cursor.executemany('''
+        INSERT INTO leaderboard_total (chat_id, user_id, points, wins)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(chat_id, user_id) DO UPDATE SET
+            points = points + excluded.points,
+            wins = wins + excluded.wins
+    ''', [(chat_id, user_id, points, wins) for (chat_id, user_id), (points, wins) in totals.items()])
+    for table, size in BUCKET_TABLES:
+        bucket = int(now) // size
+        cursor.executemany(f'''
+            INSERT INTO {table} (chat_id, bucket, user_id, points, wins)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id, bucket, user_id) DO UPDATE SET
+                points = points + excluded.points,
+                wins = wins + excluded.wins
+        ''', [(chat_id, bucket, user_id, points, wins) for (chat_id, user_id), (points, wins) in totals.items()])
+
+def query_top(cursor, period: str, chat_id: int, limit: int = None, offset: int = 0, now: float = None):
+    """Возвращает [(username, tokens)] игроков, выигрывавших в чате за период"""
+    if now is None:
+        now = time.time()
+    window = WINDOWS.get(period)
+    if window is None:
+        players = 'SELECT user_id FROM leaderboard_total WHERE chat_id = ?'
+        params = (chat_id,)
+    else:
+        table, size, length = window
+        players = f'SELECT DISTINCT user_id FROM {table} WHERE chat_id = ? AND bucket >= ?'
+        params = (chat_id, (int(now) - length) // size)
+
+    cursor.execute(f'''
+        SELECT u.username, u.tokens as total_points
+        FROM users u
+        WHERE u.user_id IN ({players})
+        AND u.tokens > 0
+        ORDER BY u.tokens DESC
+        LIMIT ? OFFSET ?
+    ''', params + (-1 if limit is None else limit, offset))
+    return cursor.fetchall()
+
+def query_top_at(cursor, chat_id: int, at: float, limit: int = None, offset: int = 0):
+    """
+    Лидерборд чата на момент at: игроки, выигравшие в чате до at, с балансом на тот момент
+    Баланс - последний снимок до at плюс записи журнала после него (как get_balance_at)
+    """
+    cursor.execute('''
+        SELECT username, balance FROM (
+            SELECT u.username,
+                   COALESCE(s.balance, 0) + (
+                       SELECT COALESCE(SUM(j.delta), 0) FROM token_journal j
+                       WHERE j.user_id = u.user_id AND j.entry_id > COALESCE(s.entry_id, 0)
+                       AND j.created_at <= ?1
+                   ) AS balance
+            FROM users u
+            LEFT JOIN balance_snapshots s ON s.user_id = u.user_id AND s.entry_id = (
+                SELECT MAX(entry_id) FROM balance_snapshots WHERE user_id = u.user_id AND taken_at <= ?1
+            )
+            WHERE u.user_id IN (
+                SELECT user_id FROM game_history
+                WHERE chat_id = ?2 AND played_at <= datetime(?1, 'unixepoch')
+                UNION
+                SELECT user_id FROM game_history_daily
+                WHERE chat_id = ?2 AND day <= date(?1, 'unixepoch')
+            )
+        )
+        WHERE balance > 0
+        ORDER BY balance DESC
+        LIMIT ?3 OFFSET ?4
+    ''', (at, chat_id, -1 if limit is None else limit, offset))
+    return cursor.fetchall()
@@ -1,8 +1,12 @@
+from startup import timer as startup_timer
+import asyncio
+
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
     ContextTypes,
 )
 from handlers import (
@@ -19,26 +23,147 @@ from handlers import (
     stats_week,
     stats_day,
     stats_hour,
+    stats_page_button,
     claim_tokens_command,
     cookie_command,
     cookie_button,
+    load_token_cooldowns,
+)
+from config import (
+    BOT_MODE,
+    COOKIE_SWEEP_INTERVAL,
+    METRICS_FILE,
+    OUTBOUND_GLOBAL_RATE,
+    SHARD_WORKERS,
+    STORAGE_BACKEND,
+    UPDATE_CONCURRENCY,
+    log_sampled,
+    logger,
+    read_token_from_file,
 )
-from config import read_token_from_file
+from cookie_game import active_games
+from outbound import OutboundRateLimiter
+from settlement import scheduler as settlement_scheduler
+from stats_view import stats_cache
 from telegram import Update
-from database import init_db
+from telegram.error import RetryAfter
+from admission import admission, admit
+import maintenance
+import metrics
+import storage
 
-# Основная функция запуска бота
-def main():
-    token = read_token_from_file('env.txt')
-    if not token:
-        print("Токен не найден в файле env.txt")
-        return
+# Фоновые циклы бота. Задачи, созданные через application.create_task до
+# запуска приложения, PTB не отслеживает, поэтому они хранятся здесь
+# и отменяются в post_stop
+background_tasks = []
 
-    init_db()
+def start_background(coro):
+    background_tasks.append(asyncio.create_task(coro))
+
+async def stop_background():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+async def post_init(application):
+    # Подключение к хранилищу (для SQLite схема уже проверена в main)
+    await storage.init_db()
+    # Восстанавливаем кулдауны /free_tokens после перезапуска
+    await load_token_cooldowns()
+    # Периодический сброс очереди отложенной записи
+    start_background(storage.flush_periodically())
+    # Расчет результатов бросков; один сброс очереди записи на пачку
+    settlement_scheduler.on_batch = storage.flush_pending
+    start_background(settlement_scheduler.run())
+    # Очистка брошенных игр "Печенька"
+    start_background(active_games.sweep_periodically(COOKIE_SWEEP_INTERVAL))
+    # Свертка и архивация старой истории игр, если хранилище ее поддерживает.
+    # При шардировании база общая - обслуживание выполняет только воркер 0
+    import sharding
+    if storage.backend.supports_maintenance and sharding.current_shard in (None, 0):
+        start_background(maintenance.run_periodically())
+    # Метрики подсистем опрашиваются при выгрузке
+    metrics.register_collector("cookie_sessions", lambda: active_games.metrics)
+    if application.bot.rate_limiter is not None:
+        metrics.register_collector("outbound", lambda: application.bot.rate_limiter.metrics)
+    metrics.register_collector("balance_cache", storage.balance_cache_metrics)
+    metrics.register_collector("admission", lambda: admission.metrics)
+    metrics.register_collector("stats_cache", lambda: {"chats": len(stats_cache)})
+    metrics.register_collector("settlement", lambda: {
+        "pending": len(settlement_scheduler),
+        "settled": settlement_scheduler.settled,
+        "batches": settlement_scheduler.batches,
+    })
+    if METRICS_FILE:
+        start_background(metrics.dump_periodically())
+    startup_timer.mark("инициализация")
+
+async def post_stop(application):
+    # Рассчитываем оставшиеся броски, пока бот еще может отправлять сообщения
+    await settlement_scheduler.drain()
+    # Новых нажатий уже не будет: незавершенные игры "Печенька" закрываются
+    # по COOKIE_EVICTION_POLICY, иначе ставки пропали бы при перезапуске
+    await active_games.close_all()
+    # Очередь записи сбрасывается в post_shutdown
+    await stop_background()
+
+async def post_shutdown(application):
+    # Закрываем вытесненные, но еще не рассчитанные игры
+    await active_games.sweep()
+    await storage.flush_pending()
+    await storage.close()
+    if METRICS_FILE:
+        metrics.dump()
+
+# Отметка первого обработанного обновления для отчета о запуске
+async def mark_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not startup_timer.reported:
+        startup_timer.mark("первое обновление")
+        logger.info(startup_timer.report())
+
+# Логирование всех обновлений
+async def log_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    log_sampled("update", "Получено обновление: %s", update)
+
+# Ошибки обработчиков. RetryAfter - отказ ограничителя отправки (outbound.py) или
+# Telegram под нагрузкой: ставка уже возвращена, трассировка не нужна
+async def log_errors(update: object, context: ContextTypes.DEFAULT_TYPE):
+    if isinstance(context.error, RetryAfter):
+        log_sampled("retry_after", "Отправка отклонена под нагрузкой: %s", context.error)
+        return
+    logger.error("Ошибка при обработке обновления", exc_info=context.error)
 
-    application = ApplicationBuilder().token(token).build()
+def build_application(token: str, with_updater: bool = True, request=None, rate_limited: bool = True,
+                      admission_control: bool = True, shards: int = 1):
+    """
+    Создает приложение со всеми обработчиками. Без updater обновления передаются в update_queue извне
+    request подменяет HTTP-клиент Bot API (см. benchmarks/replay_load.py)
+    shards - число процессов-воркеров: общий лимит исходящих делится между ними,
+    а квоты допуска считает головной процесс (admission_control=False)
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(UPDATE_CONCURRENCY)
+    )
+    if rate_limited:
+        builder = builder.rate_limiter(OutboundRateLimiter(OUTBOUND_GLOBAL_RATE / shards))
+    if request is not None:
+        builder = builder.request(request)
+    if not with_updater:
+        builder = builder.updater(None)
+    application = builder.build()
 
     # Регистрация обработчиков в правильном порядке
+    application.add_error_handler(log_errors)
+    application.add_handler(TypeHandler(Update, mark_first_update), group=-2)
+    # Квоты по пользователю, чату и команде - до обработчиков и обращений к БД
+    if admission_control:
+        application.add_handler(TypeHandler(Update, admit), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("dart", dart_command))
     application.add_handler(CommandHandler("dice", dice_command))
@@ -56,17 +181,48 @@ def main():
 
     # Сначала регистрируем обработчик для cookie
     application.add_handler(CallbackQueryHandler(cookie_button, pattern="^cookie_"))
+    application.add_handler(CallbackQueryHandler(stats_page_button, pattern="^stats_(all|month|week|day|hour)_[0-9]+$"))
     # Затем регистрируем обработчик для остальных игр с уточненным паттерном
     application.add_handler(CallbackQueryHandler(game_choice, pattern="^(dart|dice|basketball|football|slot|bowling)$"))
 
-    # Логирование всех обновлений
-    async def log_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        logger.info(f"Получено обновление: {update}")
-
     application.add_handler(MessageHandler(None, log_updates))
+    return application
+
+# Основная функция запуска бота
+def main():
+    startup_timer.mark("импорт")
+    token = read_token_from_file('env.txt')
+    if not token:
+        print("Токен не найден в файле env.txt")
+        return
+    startup_timer.mark("токен")
+
+    if SHARD_WORKERS > 1 and not storage.backend.multi_process:
+        print(f"Хранилище {STORAGE_BACKEND} не разделяется между процессами: SHARD_WORKERS должен быть 1")
+        return
+
+    storage.prepare()
+    startup_timer.mark("БД")
+
+    # Обновления распределяются по процессам-воркерам по chat_id
+    if SHARD_WORKERS > 1:
+        import sharding
+        logger.info(startup_timer.report())
+        sharding.run_front(token, SHARD_WORKERS)
+        return
+
+    application = build_application(token)
+    startup_timer.mark("приложение")
 
     # Запускаем бота
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        import webhook
+        asyncio.run(webhook.run_application(application))
+    else:
+        application.run_polling()
+
+    # Дожидаемся завершения операций с БД и записываем остаток очереди
+    storage.shutdown()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
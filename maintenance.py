@@ -0,0 +1,120 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+
+import leaderboard
+import storage
+from config import (
+    HISTORY_ARCHIVE_DIR,
+    HISTORY_RETENTION_DAYS,
+    MAINTENANCE_BATCH_PAUSE,
+    MAINTENANCE_BATCH_SIZE,
+    MAINTENANCE_INTERVAL,
+    logger,
+)
+
+# Агрегаты лидерборда за пределами самых длинных окон статистики не нужны
+HOURLY_RETENTION = 2 * leaderboard.DAY
+DAILY_RETENTION = 31 * leaderboard.DAY
+VACUUM_PAGES = 2000
+
+def _archive(rows):
+    """Дописывает строки истории в сжатые файлы по дням"""
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row[5][:10], []).append(row)
+    os.makedirs(HISTORY_ARCHIVE_DIR, exist_ok=True)
+    for day, day_rows in by_day.items():
+        # gzip допускает дописывание: файл остается корректным набором фрагментов
+        path = os.path.join(HISTORY_ARCHIVE_DIR, f"game_history-{day}.jsonl.gz")
+        with gzip.open(path, "at", encoding="utf-8") as file:
+            for history_id, user_id, chat_id, game_id, points, played_at in day_rows:
+                file.write(json.dumps({
+                    "history_id": history_id, "user_id": user_id, "chat_id": chat_id,
+                    "game_id": game_id, "points": points, "played_at": played_at,
+                }) + "\n")
+
+def _select_batch(cursor, horizon: str, limit: int) -> list:
+    """Пачка самых старых строк истории до horizon (по индексу idx_history_played)"""
+    cursor.execute('''
+        SELECT history_id, user_id, chat_id, game_id, points, played_at
+        FROM game_history
+        WHERE played_at < ?
+        ORDER BY played_at, history_id
+        LIMIT ?
+    ''', (horizon, limit))
+    return cursor.fetchall()
+
+def _rollup_batch(cursor, history_ids: list) -> list:
+    """
+    Сворачивает и удаляет строки истории. Возвращает удаленные строки
+    В агрегаты попадает только то, что удалил этот DELETE ... RETURNING:
+    строку, уже удаленную другим процессом, второй раз не посчитать
+    """
+    placeholders = ",".join("?" * len(history_ids))
+    cursor.execute(f'''
+        DELETE FROM game_history
+        WHERE history_id IN ({placeholders})
+        RETURNING history_id, user_id, chat_id, game_id, points, played_at
+    ''', history_ids)
+    rows = cursor.fetchall()
+    if not rows:
+        return rows
+
+    totals = {}
+    for _, user_id, chat_id, game_id, points, played_at in rows:
+        key = (played_at[:10], chat_id, user_id, game_id)
+        total = totals.setdefault(key, [0, 0])
+        total[0] += points
+        total[1] += 1
+    cursor.executemany('''
+        INSERT INTO game_history_daily (day, chat_id, user_id, game_id, points, wins)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(day, chat_id, user_id, game_id) DO UPDATE SET
+            points = points + excluded.points,
+            wins = wins + excluded.wins
+    ''', [key + tuple(total) for key, total in totals.items()])
+    return rows
+
+def _prune_leaderboard(cursor, now: float) -> int:
+    deleted = 0
+    for table, size, retention in (('leaderboard_hourly', leaderboard.HOUR, HOURLY_RETENTION),
+                                   ('leaderboard_daily', leaderboard.DAY, DAILY_RETENTION)):
+        cursor.execute(f'DELETE FROM {table} WHERE bucket < ?', ((int(now) - retention) // size,))
+        deleted += cursor.rowcount
+    return deleted
+
+async def run_once() -> int:
+    """Один проход обслуживания. Каждая пачка - отдельная короткая транзакция"""
+    if not storage.backend.supports_maintenance:
+        return 0
+    now = time.time()
+    horizon = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - HISTORY_RETENTION_DAYS * 86400))
+    archived = 0
+    while True:
+        rows = await storage.run_in_transaction(_select_batch, horizon, MAINTENANCE_BATCH_SIZE)
+        if not rows:
+            break
+        # Архив пишется до удаления: если запись не удалась, строки остаются в таблице.
+        # Если не удалось удаление, пачка попадет в архив повторно - дубли различимы по history_id
+        if HISTORY_ARCHIVE_DIR:
+            await asyncio.get_running_loop().run_in_executor(None, _archive, rows)
+        archived += len(await storage.run_in_transaction(_rollup_batch, [row[0] for row in rows]))
+        if len(rows) < MAINTENANCE_BATCH_SIZE:
+            break
+        await asyncio.sleep(MAINTENANCE_BATCH_PAUSE)
+    pruned = await storage.run_in_transaction(_prune_leaderboard, now)
+    await storage.incremental_vacuum(VACUUM_PAGES)
+    if archived or pruned:
+        logger.info(f"Обслуживание истории: свернуто {archived} строк, удалено {pruned} старых агрегатов")
+    return archived
+
+async def run_periodically(interval: float = MAINTENANCE_INTERVAL):
+    while True:
+        try:
+            await run_once()
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания истории: {e}")
+        await asyncio.sleep(interval)
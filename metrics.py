@@ -0,0 +1,174 @@
+import asyncio
+import functools
+import inspect
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import METRICS_FILE, METRICS_INTERVAL, logger
+
+# Метрики процесса в памяти: счетчики, гистограммы задержек и сборщики,
+# опрашиваемые при выгрузке. Запись - одно сложение или bisect по границам,
+# форматирование выполняется только в render().
+
+# Границы корзин гистограмм задержки в секундах
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+class Histogram:
+    """Гистограмма с фиксированными границами (в выгрузке - накопительная)"""
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return float("inf") if self.count else 0.0
+
+_counters: Dict[Tuple[str, Labels], Counter] = {}
+_histograms: Dict[Tuple[str, Labels], Histogram] = {}
+_collectors: Dict[str, Callable[[], Dict[str, float]]] = {}
+# Номер воркера при шардировании: у каждого процесса свой файл выгрузки
+shard: Optional[int] = None
+
+def counter(name: str, **labels: str) -> Counter:
+    key = (name, tuple(sorted(labels.items())))
+    metric = _counters.get(key)
+    if metric is None:
+        metric = _counters[key] = Counter()
+    return metric
+
+def histogram(name: str, **labels: str) -> Histogram:
+    key = (name, tuple(sorted(labels.items())))
+    metric = _histograms.get(key)
+    if metric is None:
+        metric = _histograms[key] = Histogram()
+    return metric
+
+def register_collector(prefix: str, collect: Callable[[], Dict[str, float]]):
+    """collect() возвращает {имя: значение}; выгружается как prefix_имя"""
+    _collectors[prefix] = collect
+
+def timed(name: str, **labels: str):
+    """Декоратор: время выполнения функции (синхронной или корутины) в гистограмму name"""
+    def decorator(func):
+        metric = histogram(name, **labels)
+        perf_counter = time.perf_counter
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    metric.observe(perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(perf_counter() - started)
+        return wrapper
+    return decorator
+
+def timed_handler(func):
+    return timed("handler_seconds", handler=func.__name__)(func)
+
+def timed_db(func):
+    return timed("db_seconds", function=func.__name__)(func)
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines: List[str] = []
+    typed = set()
+
+    def declare(name: str, kind: str):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), metric in sorted(_counters.items()):
+        declare(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+
+    for (name, labels), metric in sorted(_histograms.items()):
+        declare(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(metric.bounds, metric.counts):
+            cumulative += count
+            le = 'le="%s"' % bound
+            lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_format_labels(labels, le)} {metric.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {metric.sum:.6f}")
+        lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+
+    for prefix, collect in sorted(_collectors.items()):
+        try:
+            values = collect()
+        except Exception as e:
+            logger.error(f"Ошибка сборщика метрик {prefix}: {e}")
+            continue
+        for key, value in values.items():
+            name = f"{prefix}_{key}"
+            declare(name, "gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def dump_path() -> str:
+    if shard is None:
+        return METRICS_FILE
+    base, ext = os.path.splitext(METRICS_FILE)
+    return f"{base}-shard{shard}{ext}"
+
+def dump(path: str = None):
+    """Атомарно записывает метрики в файл (формат textfile-коллектора node_exporter)"""
+    path = path or dump_path()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(render())
+    os.replace(tmp_path, path)
+
+async def dump_periodically(interval: float = METRICS_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            dump()
+        except OSError as e:
+            logger.error(f"Не удалось выгрузить метрики: {e}")
@@ -0,0 +1,169 @@
+import leaderboard
+
+# Версионированные миграции схемы. Номер последней примененной миграции
+# хранится в PRAGMA user_version, поэтому при старте выполняются только новые.
+
+def _initial_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            tokens INTEGER DEFAULT 0
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            chat_name TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS games (
+            game_id TEXT PRIMARY KEY,
+            game_name TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS game_history (
+            history_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            chat_id INTEGER,
+            game_id TEXT,
+            points INTEGER,
+            played_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (chat_id) REFERENCES chats(chat_id),
+            FOREIGN KEY (game_id) REFERENCES games(game_id)
+        )
+    ''')
+
+    # Старые базы могли быть созданы без колонки tokens
+    cursor.execute("PRAGMA table_info(users)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'tokens' not in columns:
+        cursor.execute('ALTER TABLE users ADD COLUMN tokens INTEGER DEFAULT 0')
+
+    # Заполняем справочник игр, игнорируя дубликаты
+    games = [
+        ('dart', 'Дартс'),
+        ('dice', 'Кубики'),
+        ('basketball', 'Баскетбол'),
+        ('football', 'Футбол'),
+        ('slot', 'Слоты'),
+        ('bowling', 'Боулинг')
+    ]
+    cursor.executemany('''
+        INSERT OR IGNORE INTO games (game_id, game_name)
+        VALUES (?, ?)
+    ''', games)
+
+def _history_indexes(cursor):
+    # Выборки истории по чату за период и по игроку в чате
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_history_chat_played
+        ON game_history (chat_id, played_at, user_id, points)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_history_user_chat
+        ON game_history (user_id, chat_id, played_at)
+    ''')
+    # Сортировка игроков по балансу в статистике
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_tokens ON users (tokens)')
+
+def _cooldowns(cursor):
+    # Долгие кулдауны (например, /free_tokens), переживающие перезапуск
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cooldowns (
+            scope TEXT,
+            key INTEGER,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+    ''')
+
+def _token_journal(cursor):
+    # Журнал всех изменений баланса; дописывается пачками при сбросе очереди
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS token_journal (
+            entry_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_journal_user
+        ON token_journal (user_id, entry_id)
+    ''')
+    # Снимки баланса: баланс пользователя после записи entry_id
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            user_id INTEGER,
+            entry_id INTEGER,
+            balance INTEGER NOT NULL,
+            taken_at REAL NOT NULL,
+            PRIMARY KEY (user_id, entry_id)
+        ) WITHOUT ROWID
+    ''')
+    # Начальные балансы появились до журнала - фиксируем их снимком
+    cursor.execute('''
+        INSERT OR IGNORE INTO balance_snapshots (user_id, entry_id, balance, taken_at)
+        SELECT user_id, 0, tokens, strftime('%s', 'now') FROM users
+    ''')
+
+def _history_rollup(cursor):
+    # Дневные агрегаты по истории, вышедшей за горизонт хранения (см. maintenance.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS game_history_daily (
+            day TEXT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            game_id TEXT,
+            points INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, chat_id, user_id, game_id)
+        ) WITHOUT ROWID
+    ''')
+
+def _history_played_index(cursor):
+    # Обслуживание выбирает самые старые строки истории (см. maintenance.py)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_history_played
+        ON game_history (played_at, history_id)
+    ''')
+
+# Порядок важен: индекс в списке + 1 = версия схемы
+MIGRATIONS = [
+    _initial_schema,
+    leaderboard.create_tables,
+    _history_indexes,
+    _cooldowns,
+    _token_journal,
+    _history_rollup,
+    _history_played_index,
+]
+
+def get_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn) -> int:
+    """Применяет недостающие миграции, каждую в своей транзакции. Возвращает версию схемы"""
+    version = get_version(conn)
+    if version >= len(MIGRATIONS):
+        return version
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = number
+    return version
@@ -0,0 +1,180 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Coroutine, Dict, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import (
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_CHAT_MAX_WAITING,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_GROUP_RATE,
+    OUTBOUND_MAX_RETRIES,
+    logger,
+)
+
+# Запросы, которые Telegram не ограничивает по чату (ответ на нажатие кнопки и т.п.)
+UNLIMITED_ENDPOINTS = {"answerCallbackQuery", "getMe", "getUpdates", "setWebhook", "deleteWebhook"}
+# Правки сообщения: в очереди остается только последняя
+COALESCED_ENDPOINTS = {"editMessageText", "editMessageReplyMarkup"}
+MAX_IDLE_BUCKETS = 10000
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waiting = 0  # Запросов в очереди корзины
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+    async def acquire(self):
+        # Блокировка сохраняет порядок очереди внутри корзины
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    self._refill(time.monotonic())
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """
+    Ограничитель исходящих запросов бота
+    Корзины токенов на весь бот и на каждый чат, склейка правок одного
+    сообщения в последнюю и повтор запросов после RetryAfter.
+    Ожидание корзины чата занимает слот обработки обновлений, поэтому очередь
+    чата ограничена OUTBOUND_CHAT_MAX_WAITING: сверх нее запрос сразу
+    завершается RetryAfter, как при ответе 429 от Telegram, и один
+    загруженный чат не забирает все слоты concurrent_updates
+    """
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE):
+        # При шардировании каждый воркер получает свою долю общего лимита бота
+        self._global = TokenBucket(global_rate, max(global_rate, 1.0))
+        # Порядок - от давно не использованных корзин к недавним
+        self._chats: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        # (chat_id, message_id) -> номер последней поставленной правки
+        self._latest_edit: Dict[Tuple[Any, Any], int] = {}
+        self._edit_seq = 0
+        self.queue_depth = 0
+        self.requests = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+        else:
+            # Полные корзины ничего не помнят - их можно удалить. Давно не
+            # использованные - в начале словаря, проверка идет до первой занятой
+            while len(self._chats) >= MAX_IDLE_BUCKETS:
+                oldest = next(iter(self._chats.values()))
+                if not oldest.is_idle:
+                    break
+                self._chats.popitem(last=False)
+            # Отрицательный chat_id - группа или канал
+            rate = OUTBOUND_GROUP_RATE if isinstance(chat_id, int) and chat_id < 0 else OUTBOUND_CHAT_RATE
+            bucket = self._chats[chat_id] = TokenBucket(rate, OUTBOUND_CHAT_BURST)
+        return bucket
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Any],
+    ):
+        self.requests += 1
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get("chat_id")
+        bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        if bucket is not None and bucket.waiting >= OUTBOUND_CHAT_MAX_WAITING:
+            self.rejected += 1
+            raise RetryAfter(max(1, round(bucket.waiting / bucket.rate)))
+
+        edit_key = None
+        if endpoint in COALESCED_ENDPOINTS and data.get("message_id") is not None:
+            edit_key = (chat_id, data["message_id"])
+            self._edit_seq += 1
+            seq = self._latest_edit[edit_key] = self._edit_seq
+
+        self.queue_depth += 1
+        queued_at = time.monotonic()
+        try:
+            if bucket is not None:
+                await bucket.acquire()
+            if edit_key is not None and self._latest_edit.get(edit_key) != seq:
+                # Пока правка ждала очереди, пришла более новая - отправим только ее
+                if bucket is not None:
+                    bucket.refund()
+                self.coalesced += 1
+                return True
+            await self._global.acquire()
+        finally:
+            self.queue_depth -= 1
+            waited = time.monotonic() - queued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+        try:
+            for attempt in range(OUTBOUND_MAX_RETRIES + 1):
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    if attempt == OUTBOUND_MAX_RETRIES:
+                        raise
+                    delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                    logger.warning(f"Telegram ограничил {endpoint} в чате {chat_id}, повтор через {delay} с")
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+        finally:
+            if edit_key is not None and self._latest_edit.get(edit_key) == seq:
+                del self._latest_edit[edit_key]
+
+    @property
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "queue_depth": self.queue_depth,
+            "requests": self.requests,
+            "coalesced_edits": self.coalesced,
+            "retries": self.retries,
+            "rejected_chat_queue": self.rejected,
+            "wait_avg_seconds": self.wait_total / self.requests if self.requests else 0.0,
+            "wait_max_seconds": self.wait_max,
+        }
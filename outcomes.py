@@ -0,0 +1,102 @@
+from typing import TYPE_CHECKING, Dict, NamedTuple, Tuple
+
+if TYPE_CHECKING:
+    # fractions тянет за собой decimal; боту при запуске он не нужен
+    from fractions import Fraction
+
+# Таблицы исходов для эмодзи-игр. Для каждой игры заранее строится кортеж
+# исходов, индексируемый значением кубика, поэтому расчет броска - это
+# один поиск в таблице. Новая игра добавляется записью в GAMES.
+
+# Константа для ставки
+BET_AMOUNT = 300
+
+POINTS = {
+    "dart": 1200,      # Попадание в центр
+    "dice": 600,       # Базовое значение для кубиков (будет умножаться на выпавшее число)
+    "basketball": 400, # Попадание в корзину
+    "football": 300,   # Гол
+    "bowling": 600,    # Страйк
+    "slot": {
+        1: ("🍫🍫🍫", 2000),  # Три бара
+        43: ("🍋🍋🍋", 3000), # Три лимона
+        22: ("🍒🍒🍒", 4000), # Три вишни
+        64: ("7⃣7⃣7⃣", 7000)  # 777
+    }
+}
+
+class Outcome(NamedTuple):
+    points: int
+    result: str  # Описание исхода
+    edit_text: str  # Полный текст при выборе игры кнопкой
+    reply_text: str  # Полный текст при выборе игры командой
+
+class GameSpec(NamedTuple):
+    emoji: str
+    faces: int  # Значения кубика: 1..faces
+    dice: int  # Количество бросков за игру
+    wins: Dict[int, Tuple[int, str]]  # значение -> (очки, описание выигрыша)
+    lose: str  # Описание проигрыша
+
+GAMES: Dict[str, GameSpec] = {
+    "dart": GameSpec("🎯", 6, 1, {6: (POINTS["dart"], "🎯 Попал в центр!")}, "❌ Не попал в центр."),
+    "dice": GameSpec("🎲", 6, 2, {}, ""),  # Выигрыш при дубле, см. _pair_table
+    "basketball": GameSpec("🏀", 5, 1, {v: (POINTS["basketball"], "🏀 Попал в корзину!") for v in (4, 5)}, "❌ Не попал в корзину."),
+    "football": GameSpec("⚽️", 5, 1, {v: (POINTS["football"], "⚽️ Попал в ворота!") for v in (3, 4, 5)}, "❌ Не попал в ворота."),
+    "slot": GameSpec("🎰", 64, 1, {v: (p, f"🎰 Выпало: {symbol} 🎉 Вы выиграли!") for v, (symbol, p) in POINTS["slot"].items()}, "❌ Вы проиграли."),
+    "bowling": GameSpec("🎳", 6, 1, {6: (POINTS["bowling"], "🎳 Страйк! 🎉 Все кегли сбиты!")}, "❌ Неудача. Попробуйте еще раз."),
+}
+
+EMOJI = {game_type: spec.emoji for game_type, spec in GAMES.items()}
+
+def _outcome(game_type: str, points: int, result: str) -> Outcome:
+    header = f"Вы выбрали игру {game_type.capitalize()}.\n{result}"
+    if points > 0:
+        return Outcome(points, result, f"{header}\n💰 Выигрыш: {points} токенов", f"{header} Выигрыш: {points} токенов")
+    return Outcome(points, result, header, header)
+
+def _single_table(game_type: str, spec: GameSpec) -> Tuple[Outcome, ...]:
+    lose = _outcome(game_type, 0, spec.lose)
+    # Индекс 0 не используется: значения кубика начинаются с 1
+    return (lose,) + tuple(
+        _outcome(game_type, *spec.wins[value]) if value in spec.wins else lose
+        for value in range(1, spec.faces + 1)
+    )
+
+def _pair_table(game_type: str, spec: GameSpec) -> Tuple[Outcome, ...]:
+    # Кубики: дубль выигрывает базовые очки, умноженные на выпавшее число
+    table = []
+    for first in range(1, spec.faces + 1):
+        for second in range(1, spec.faces + 1):
+            if first == second:
+                table.append(_outcome(game_type, POINTS[game_type] * first,
+                                      f"🎲 Выпало: {first} и {second}. 🎉 Вы выиграли! (x{first})"))
+            else:
+                table.append(_outcome(game_type, 0, f"🎲 Выпало: {first} и {second}. ❌ Вы проиграли."))
+    return tuple(table)
+
+TABLES: Dict[str, Tuple[Outcome, ...]] = {
+    game_type: _pair_table(game_type, spec) if spec.dice == 2 else _single_table(game_type, spec)
+    for game_type, spec in GAMES.items()
+}
+
+def settle(game_type: str, value: int, second: int = None) -> Outcome:
+    """Исход броска. Для игр с двумя бросками передается и второе значение"""
+    if second is None:
+        return TABLES[game_type][value]
+    return TABLES[game_type][(value - 1) * GAMES[game_type].faces + second - 1]
+
+def outcomes(game_type: str) -> Tuple[Outcome, ...]:
+    """Все равновероятные исходы игры"""
+    table = TABLES[game_type]
+    return table if GAMES[game_type].dice == 2 else table[1:]
+
+def expected_points(game_type: str) -> "Fraction":
+    """Точное математическое ожидание выигрыша за одну игру"""
+    from fractions import Fraction
+    table = outcomes(game_type)
+    return Fraction(sum(outcome.points for outcome in table), len(table))
+
+def rtp(game_type: str, bet: int = BET_AMOUNT) -> "Fraction":
+    """Доля ставки, возвращаемая игроку в среднем (return to player)"""
+    return expected_points(game_type) / bet
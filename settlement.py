@@ -0,0 +1,108 @@
+import asyncio
+import heapq
+import itertools
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from config import SETTLEMENT_MAX_BATCHES, SETTLEMENT_MAX_PENDING, SETTLEMENT_TICK, logger
+
+Job = Callable[[], Awaitable[None]]
+
+class SettlementScheduler:
+    """
+    Единый таймер для расчета результатов бросков
+    Задачи хранятся в куче по сроку; все задачи, срок которых наступил
+    в пределах одного тика, выполняются пачкой, после чего один раз
+    вызывается on_batch (сброс очереди записи в БД)
+    Пачка выполняется в отдельной задаче: медленная пачка (ожидание
+    ограничителя отправки, RetryAfter) не задерживает следующие сроки
+    """
+
+    def __init__(self, max_pending: int = SETTLEMENT_MAX_PENDING, tick: float = SETTLEMENT_TICK,
+                 max_batches: int = SETTLEMENT_MAX_BATCHES):
+        self.max_pending = max_pending
+        self.tick = tick
+        self._batch_slots = asyncio.Semaphore(max_batches)
+        self._running: Set[asyncio.Task] = set()
+        self.on_batch: Optional[Callable[[], Awaitable[None]]] = None
+        self._heap: List[Tuple[float, int, Job]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closed = False
+        self.settled = 0
+        self.batches = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    @property
+    def is_full(self) -> bool:
+        """Очередь переполнена - новые броски стоит отклонять"""
+        return len(self._heap) >= self.max_pending
+
+    def schedule(self, delay: float, job: Job):
+        """Планирует job через delay секунд"""
+        loop = asyncio.get_running_loop()
+        if self._closed:
+            # После остановки рассчитываем сразу
+            self._start_batch([job])
+            return
+        deadline = loop.time() + delay
+        heapq.heappush(self._heap, (deadline, next(self._seq), job))
+        # Будим таймер, только если новая задача стала ближайшей
+        if self._wakeup is not None and self._heap[0][2] is job:
+            self._wakeup.set()
+
+    def _pop_due(self, now: float) -> List[Job]:
+        due = []
+        while self._heap and self._heap[0][0] <= now + self.tick:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    async def _run_batch(self, jobs: List[Job]):
+        async with self._batch_slots:
+            results = await asyncio.gather(*(job() for job in jobs), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Ошибка при обработке результата: {result}")
+            self.settled += len(jobs)
+            self.batches += 1
+            if self.on_batch is not None:
+                await self.on_batch()
+
+    def _start_batch(self, jobs: List[Job]):
+        task = asyncio.get_running_loop().create_task(self._run_batch(jobs))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def run(self):
+        """Основной цикл таймера"""
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while not self._closed:
+            timeout = self._heap[0][0] - loop.time() if self._heap else None
+            if timeout is None or timeout > self.tick:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = self._pop_due(loop.time())
+            if due:
+                self._start_batch(due)
+
+    async def drain(self):
+        """Останавливает таймер и немедленно рассчитывает все ожидающие задачи"""
+        self._closed = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        jobs = [job for _, _, job in sorted(self._heap)]
+        self._heap.clear()
+        if jobs:
+            self._start_batch(jobs)
+        # Дожидаемся и пачек, запущенных таймером раньше
+        while self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+# Общий планировщик расчета бросков
+scheduler = SettlementScheduler()
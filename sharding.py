@@ -0,0 +1,269 @@
+import asyncio
+import multiprocessing
+import signal
+from queue import Full
+from typing import Callable, List, Optional, Tuple
+
+from admission import REJECTED_ALERT, admit_data
+from config import BOT_MODE, SHARD_CHECK_INTERVAL, SHARD_QUEUE_SIZE, logger
+
+# Все обновления чата попадают в один воркер (по chat_id): воркер владеет
+# играми "Печенька", кэшем статистики и корзиной исходящих своих чатов.
+# Состояние пользователя, который пишет в чаты разных воркеров, общее:
+#   - баланс токенов - в хранилище; SQLite в режиме WAL пропускает одного
+#     писателя за раз, поэтому списания атомарны (try_debit), а воркеры ждут
+#     друг друга не дольше busy_timeout;
+#   - кулдауны игр и /free_tokens воркеры занимают в хранилище (claim_cooldown);
+#   - квоты допуска по пользователю, чату и команде считает головной процесс;
+#   - общий лимит исходящих сообщений делится между воркерами поровну.
+
+def shard_key(data: dict) -> int:
+    """Ключ шардирования для обновления в виде JSON"""
+    message = data.get("message") or data.get("edited_message")
+    if message:
+        return message["chat"]["id"]
+    query = data.get("callback_query")
+    if query:
+        if query.get("message"):
+            return query["message"]["chat"]["id"]
+        return query["from"]["id"]
+    return 0
+
+# Номер шарда в процессе-воркере (None - бот работает одним процессом)
+current_shard: Optional[int] = None
+
+def worker_main(index: int, queue, token: str, shards: int):
+    """Точка входа процесса-воркера"""
+    # Остановкой управляет головной процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker(index, queue, token, shards))
+
+async def _worker(index: int, queue, token: str, shards: int):
+    import database
+    import handlers
+    import metrics
+    import storage
+    from main import build_application
+
+    global current_shard
+    current_shard = index
+    database.shared_writers = True
+    handlers.shared_cooldowns = True
+    metrics.shard = index
+    # Квоты допуска уже проверены головным процессом
+    application = build_application(token, with_updater=False, admission_control=False, shards=shards)
+    try:
+        await serve(application, queue)
+    finally:
+        storage.shutdown()
+
+async def serve(application, queue) -> int:
+    """
+    Обрабатывает обновления из очереди воркера до None; возвращает их число
+    Перед выходом дожидается обработки принятых обновлений и расчета бросков
+    """
+    from telegram import Update
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    logger.info(f"Воркер {current_shard} запущен")
+
+    loop = asyncio.get_running_loop()
+    processed = 0
+    try:
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+            processed += 1
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+    return processed
+
+class Dispatcher:
+    """
+    Проверяет квоты допуска и раскладывает обновления по очередям воркеров;
+    полная очередь тормозит прием. bot нужен для предупреждения об отказе.
+    Если заданы processes и spawn, следит за воркерами: упавший воркер
+    перезапускается с новой очередью (spawn(index) -> (процесс, очередь)),
+    обновления из очереди упавшего теряются
+    """
+
+    def __init__(self, queues: List, bot=None, admission_control: bool = True,
+                 processes: List = None, spawn: Callable[[int], Tuple] = None):
+        self.queues = queues
+        self.bot = bot
+        self.admission_control = admission_control
+        self.processes = processes
+        self.spawn = spawn
+        self.dispatched = [0] * len(queues)
+        self.rejected = 0
+        self.restarts = 0
+
+    async def _reject(self, data: dict, first: bool):
+        from telegram.error import TelegramError
+
+        self.rejected += 1
+        query = data.get("callback_query")
+        # Как и admit: предупреждаем один раз за окно
+        if first and query and self.bot is not None:
+            try:
+                await self.bot.answer_callback_query(query["id"], REJECTED_ALERT, show_alert=True)
+            except TelegramError as e:
+                logger.warning(f"Не удалось ответить на отклоненный запрос: {e}")
+
+    def is_alive(self, index: int) -> bool:
+        return self.processes is None or self.processes[index].is_alive()
+
+    def check_workers(self):
+        """Перезапускает завершившиеся воркеры"""
+        if self.processes is None:
+            return
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+            self.processes[index], self.queues[index] = self.spawn(index)
+            self.restarts += 1
+
+    async def supervise(self):
+        """Фоновая проверка воркеров раз в SHARD_CHECK_INTERVAL"""
+        while True:
+            await asyncio.sleep(SHARD_CHECK_INTERVAL)
+            self.check_workers()
+
+    async def dispatch(self, data: dict):
+        if self.admission_control:
+            scope, first = admit_data(data)
+            if scope is not None:
+                await self._reject(data, first)
+                return
+        index = shard_key(data) % len(self.queues)
+        self.dispatched[index] += 1
+        try:
+            self.queues[index].put_nowait(data)
+            return
+        except Full:
+            pass
+        # Воркер не успевает - ждем места, не блокируя event loop. Ожидание
+        # ограничено: очередь упавшего воркера не освободится никогда
+        loop = asyncio.get_running_loop()
+        while True:
+            queue = self.queues[index]
+            try:
+                await loop.run_in_executor(None, queue.put, data, True, SHARD_CHECK_INTERVAL)
+                return
+            except Full:
+                if self.is_alive(index):
+                    logger.warning(f"Очередь воркера {index} заполнена дольше {SHARD_CHECK_INTERVAL} с")
+                    continue
+            self.check_workers()
+
+    def stop_workers(self):
+        """Передает воркерам сигнал остановки и дожидается их завершения"""
+        for index, queue in enumerate(self.queues):
+            # Живой воркер разберет очередь до конца; упавшему передавать нечего
+            while self.is_alive(index):
+                try:
+                    queue.put(None, timeout=SHARD_CHECK_INTERVAL)
+                    break
+                except Full:
+                    continue
+        for process in self.processes or ():
+            process.join()
+
+POLL_BACKOFF_MAX = 60.0  # Максимальная пауза после ошибок getUpdates, с
+
+async def _poll(bot, dispatcher: Dispatcher, stop: asyncio.Event):
+    from telegram import Update
+    from telegram.error import RetryAfter, TelegramError
+
+    offset = None
+    backoff = 1.0
+    # getUpdates не работает, пока у бота установлен вебхук
+    await bot.delete_webhook()
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            logger.warning(f"Flood control при получении обновлений, пауза {delay} с")
+            await asyncio.sleep(delay)
+            continue
+        except TelegramError as e:
+            # Сеть, Conflict (второй getUpdates), ошибки сервера: единственный
+            # приемщик обновлений не должен завершаться - ждем и повторяем
+            logger.error(f"Ошибка получения обновлений: {e}, повтор через {backoff:.0f} с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, POLL_BACKOFF_MAX)
+            continue
+        backoff = 1.0
+        for update in updates:
+            offset = update.update_id + 1
+            await dispatcher.dispatch(update.to_dict())
+
+async def _front(token: str, dispatcher: Dispatcher):
+    from telegram import Bot, Update
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    async with Bot(token) as bot:
+        dispatcher.bot = bot
+        supervisor = asyncio.create_task(dispatcher.supervise())
+        if BOT_MODE == "webhook":
+            from config import WEBHOOK_MAX_CONNECTIONS, WEBHOOK_SECRET, WEBHOOK_URL
+            from webhook import WebhookServer
+            server = WebhookServer(dispatcher.dispatch)
+            await server.start()
+            if WEBHOOK_URL:
+                await bot.set_webhook(
+                    url=WEBHOOK_URL,
+                    secret_token=WEBHOOK_SECRET or None,
+                    max_connections=WEBHOOK_MAX_CONNECTIONS,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+            await stop.wait()
+            await server.stop()
+        else:
+            poller = asyncio.create_task(_poll(bot, dispatcher, stop))
+            await stop.wait()
+            poller.cancel()
+            try:
+                await poller
+            except asyncio.CancelledError:
+                pass
+        supervisor.cancel()
+
+def run_front(token: str, workers: int):
+    """Головной процесс: принимает обновления и отдает их воркерам"""
+    # spawn: воркеры открывают собственные соединения с БД
+    context = multiprocessing.get_context("spawn")
+
+    def spawn(index: int):
+        queue = context.Queue(SHARD_QUEUE_SIZE)
+        process = context.Process(target=worker_main, args=(index, queue, token, workers), name=f"shard-{index}")
+        process.start()
+        return process, queue
+
+    processes, queues = (list(items) for items in zip(*(spawn(index) for index in range(workers))))
+    dispatcher = Dispatcher(queues, processes=processes, spawn=spawn)
+    try:
+        asyncio.run(_front(token, dispatcher))
+    finally:
+        dispatcher.stop_workers()
+        logger.info(f"Обновлений по воркерам: {dispatcher.dispatched}, отклонено квотами: {dispatcher.rejected}, "
+                    f"перезапусков воркеров: {dispatcher.restarts}")
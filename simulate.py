@@ -0,0 +1,122 @@
+"""
+Симулятор экономики игр: RTP, дисперсия и эмиссия токенов
+
+Эмодзи-игры считаются точно по таблицам outcomes.py и методом Монте-Карло
+(векторизованно через NumPy). Для "Печеньки" стратегии "остановиться после
+k печенек" считаются точно, оптимальная остановка - динамическим программированием.
+
+    python simulate.py --plays 10000000
+    python simulate.py --bet 300 --bombs 5 7 9 --reward 400 500
+"""
+import argparse
+import inspect
+import time
+from fractions import Fraction
+from typing import List, Tuple
+
+from cookie_game import CookieGame
+from outcomes import BET_AMOUNT, GAMES, TABLES, expected_points, outcomes
+
+try:
+    import numpy as np
+except ImportError:  # Без NumPy доступны только точные расчеты
+    np = None
+
+def exact_stats(game_type: str) -> Tuple[Fraction, Fraction]:
+    """Точные математическое ожидание и дисперсия выигрыша за игру"""
+    table = outcomes(game_type)
+    mean = expected_points(game_type)
+    variance = Fraction(sum(o.points ** 2 for o in table), len(table)) - mean ** 2
+    return mean, variance
+
+def monte_carlo(game_type: str, plays: int, rng) -> Tuple[float, float]:
+    """Среднее и дисперсия выигрыша по plays случайным броскам"""
+    spec = GAMES[game_type]
+    points = np.fromiter((o.points for o in TABLES[game_type]), dtype=np.int64)
+    if spec.dice == 2:
+        first = rng.integers(0, spec.faces, size=plays)
+        second = rng.integers(0, spec.faces, size=plays)
+        won = points[first * spec.faces + second]
+    else:
+        won = points[rng.integers(1, spec.faces + 1, size=plays)]
+    return float(won.mean()), float(won.var())
+
+def cookie_strategies(size: int, bombs: int, reward: int) -> List[Tuple[int, Fraction, Fraction]]:
+    """
+    Для каждого k: (k, вероятность открыть k печенек подряд, ожидаемый выигрыш)
+    Ячейки равноправны, поэтому вероятность не зависит от порядка открытия
+    """
+    cells = size * size
+    safe = cells - bombs
+    result = []
+    survive = Fraction(1)
+    for k in range(1, safe + 1):
+        survive *= Fraction(safe - k + 1, cells - k + 1)
+        result.append((k, survive, survive * k * reward))
+    return result
+
+def cookie_optimal(size: int, bombs: int, reward: int) -> Tuple[Fraction, int]:
+    """
+    Оптимальная остановка: V(k) = max(k * reward, p_k * V(k + 1)),
+    где p_k - вероятность, что следующая ячейка без бомбы. Возвращает (V(0), k остановки)
+    """
+    cells = size * size
+    safe = cells - bombs
+    value = Fraction(safe * reward)
+    stop = safe
+    for k in range(safe - 1, -1, -1):
+        cont = Fraction(safe - k, cells - k) * value
+        if k > 0 and k * reward >= cont:
+            value, stop = Fraction(k * reward), k
+        else:
+            value = cont
+    return value, stop
+
+def report_dice(bet: int, plays: int, seed: int):
+    print(f"Эмодзи-игры, ставка {bet}")
+    print(f"{'игра':<12}{'RTP':>8}{'σ выигрыша':>12}{'эмиссия/игру':>14}"
+          + (f"{'RTP (MC)':>10}{'игр/с':>14}" if np else ""))
+    rng = np.random.default_rng(seed) if np else None
+    for game_type in GAMES:
+        mean, variance = exact_stats(game_type)
+        line = (f"{game_type:<12}{float(mean / bet):>8.4f}{float(variance) ** 0.5:>12.1f}"
+                f"{float(mean - bet):>+14.1f}")
+        if np:
+            start = time.perf_counter()
+            mc_mean, _ = monte_carlo(game_type, plays, rng)
+            elapsed = time.perf_counter() - start
+            line += f"{mc_mean / bet:>10.4f}{plays / elapsed:>14,.0f}"
+        print(line)
+    if np is None:
+        print("NumPy не установлен: метод Монте-Карло пропущен")
+
+def report_cookie(size: int, bombs: int, reward: int, bet: int, verbose: bool):
+    optimal, stop = cookie_optimal(size, bombs, reward)
+    print(f"\nПеченька {size}x{size}, бомб {bombs}, награда {reward}, ставка {bet}: "
+          f"оптимально остановиться после {stop}, RTP {float(optimal / bet):.4f}, "
+          f"эмиссия {float(optimal - bet):+.1f}/игру")
+    if verbose:
+        print(f"{'k':>4}{'P(дойти)':>12}{'RTP':>10}{'σ':>10}")
+        for k, survive, ev in cookie_strategies(size, bombs, reward):
+            variance = survive * (k * reward) ** 2 - ev ** 2
+            print(f"{k:>4}{float(survive):>12.5f}{float(ev / bet):>10.4f}{float(variance) ** 0.5:>10.1f}")
+
+def main():
+    defaults = inspect.signature(CookieGame).parameters
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--plays', type=int, default=1_000_000, help='бросков на игру для Монте-Карло')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bet', type=int, default=BET_AMOUNT)
+    parser.add_argument('--size', type=int, default=defaults['size'].default)
+    parser.add_argument('--bombs', type=int, nargs='+', default=[defaults['bomb_count'].default])
+    parser.add_argument('--reward', type=int, nargs='+', default=[defaults['base_reward'].default])
+    parser.add_argument('--strategies', action='store_true', help='таблица по всем стратегиям остановки')
+    args = parser.parse_args()
+
+    report_dice(args.bet, args.plays, args.seed)
+    for bombs in args.bombs:
+        for reward in args.reward:
+            report_cookie(args.size, bombs, reward, args.bet, args.strategies)
+
+if __name__ == '__main__':
+    main()
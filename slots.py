@@ -1,4 +1,7 @@
+import logging
+
 from config import logger
+from outcomes import POINTS, settle
 
 # Стандартные стикеры для слотов
 stickers = [
@@ -25,33 +28,26 @@ stickers = [
     20,  # Right slot spinning animation
 ]
 
-# Выигрышные комбинации и их коэффициенты
-WINNING_COMBINATIONS = {
-    (4, 10, 16): ("🍫🍫🍫", 2),  # Х2
-    (6, 12, 18): ("🍋🍋🍋", 3),  # Х3
-    (5, 11, 17): ("🍒🍒🍒", 4),  # Х4
-    (7, 13, 19): ("7⃣7⃣7⃣", 7),  # Х7
-}
-
-# Функция для интерпретации результата для слотов
-def interpret_slot_result(result):
-    # Log the full result
-    logger.info(f"Full slot result: {result}")
-
-    # Разделяем значение на три 2-битных поля
+def decode_slot_value(result):
+    """Разделяет значение слота (1..64) на три 2-битных поля (левый, центр, правый)"""
     left_slot = (result - 1) & 3  # Первые 2 бита
     center_slot = ((result - 1) >> 2) & 3  # Следующие 2 бита
     right_slot = ((result - 1) >> 4) & 3  # Последние 2 бита
+    return left_slot, center_slot, right_slot
 
-    # Log the individual slot values
-    logger.info(f"Slot values - Left: {left_slot}, Center: {center_slot}, Right: {right_slot}")
+# Выигрышные комбинации берутся из таблицы исходов: комбинация -> (символы, очки)
+WINNING_COMBINATIONS = {
+    decode_slot_value(value): (symbol, points)
+    for value, (symbol, points) in POINTS["slot"].items()
+}
 
-    # Формируем комбинацию
-    combination = (left_slot, center_slot, right_slot)
+# Функция для интерпретации результата для слотов
+def interpret_slot_result(result):
+    """Возвращает (описание, очки) для значения слота"""
+    # Подробности пишутся только в режиме отладки и форматируются лениво
+    if logger.isEnabledFor(logging.DEBUG):
+        left_slot, center_slot, right_slot = decode_slot_value(result)
+        logger.debug("Slot result %s - Left: %s, Center: %s, Right: %s", result, left_slot, center_slot, right_slot)
 
-    # Проверяем, является ли комбинация выигрышной
-    if combination in WINNING_COMBINATIONS:
-        winning_symbol, multiplier = WINNING_COMBINATIONS[combination]
-        return f"🎰 Выпало: {winning_symbol} 🎉 Вы выиграли x{multiplier}!", multiplier
-    else:
-        return "❌ Не повезло. Попробуйте еще раз!"
+    outcome = settle("slot", result)
+    return outcome.result, outcome.points
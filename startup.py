@@ -0,0 +1,26 @@
+import time
+
+# Замер фаз запуска бота. Модуль импортируется первым в main.py, поэтому
+# первая фаза включает импорт библиотек и модулей бота.
+
+class StartupTimer:
+    """Длительность каждой фазы запуска от предыдущей отметки"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases = []
+        self.reported = False
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self) -> str:
+        self.reported = True
+        parts = ", ".join(f"{phase} {duration * 1000:.1f} мс" for phase, duration in self.phases)
+        total = (self._last - self.started) * 1000
+        return f"Запуск: {parts}; всего {total:.1f} мс"
+
+timer = StartupTimer()
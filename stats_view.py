@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import STATS_CACHE_MAX_CHATS, STATS_CACHE_TTL, STATS_PAGE_SIZE
+
+STATS_TITLES = {
+    'all': "🏆 Статистика за всё время:",
+    'month': "📅(30) Статистика за месяц:",
+    'week': "📅(7) Статистика за неделю:",
+    'day': "📅(1) Статистика за день:",
+    'hour': "⏰ Статистика за час:",
+}
+
+Page = Tuple[str, Optional[InlineKeyboardMarkup]]
+
+def render_page(period: str, rows: List[Tuple[str, int]], page: int, has_next: bool) -> Page:
+    """Текст страницы статистики и кнопки перехода между страницами"""
+    first = page * STATS_PAGE_SIZE + 1
+    lines = [STATS_TITLES[period]]
+    lines.extend(f"{idx}. @{username}: {points} очков" for idx, (username, points) in enumerate(rows, start=first))
+    text = "\n".join(lines) + "\n"
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️", callback_data=f"stats_{period}_{page - 1}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("➡️", callback_data=f"stats_{period}_{page + 1}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+class PageCache:
+    """
+    Кэш отрисованных страниц по (chat_id, period) с коротким временем жизни
+    Сбрасывается для чата целиком, когда в нем начислены токены (выигрыш,
+    /free_tokens, приз "Печеньки"). Ставки и изменения баланса игрока в других
+    чатах кэш не сбрасывают: такие страницы устаревают не дольше чем на ttl.
+    Хранит не больше max_chats чатов: вытесняются чаты, страницы которых
+    записаны раньше всех, то есть в первую очередь истекшие
+    """
+
+    def __init__(self, ttl: float = STATS_CACHE_TTL, max_chats: int = STATS_CACHE_MAX_CHATS):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self._pages: "OrderedDict[int, Dict[Tuple[str, int], Tuple[float, Page]]]" = OrderedDict()
+
+    def get(self, chat_id: int, period: str, page: int) -> Optional[Page]:
+        entry = self._pages.get(chat_id, {}).get((period, page))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def put(self, chat_id: int, period: str, page: int, value: Page):
+        now = time.monotonic()
+        # Истекшие страницы чата удаляются при записи новой
+        pages = {key: entry for key, entry in self._pages.pop(chat_id, {}).items() if entry[0] >= now}
+        pages[(period, page)] = (now + self.ttl, value)
+        self._pages[chat_id] = pages
+        if len(self._pages) > self.max_chats:
+            self._pages.popitem(last=False)
+
+    def invalidate(self, chat_id: int):
+        self._pages.pop(chat_id, None)
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+# Общий кэш страниц статистики
+stats_cache = PageCache()
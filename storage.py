@@ -0,0 +1,103 @@
+import asyncio
+import weakref
+from typing import Optional
+
+import database
+from config import logger
+from storage_backend import REASON_ADJUST, REASON_BET, StorageBackend, create_backend
+
+# Асинхронный доступ к хранилищу для обработчиков. Реализация выбирается
+# настройкой STORAGE_BACKEND (см. storage_backend.py)
+backend: StorageBackend = create_backend()
+
+def use_backend(new_backend: StorageBackend):
+    """Подменяет хранилище (тесты, бенчмарки); вызывать до запуска бота"""
+    global backend
+    backend = new_backend
+
+# Блокировки по пользователю для последовательностей "проверить - начислить".
+# Слабые ссылки: блокировка живет, пока ее кто-то держит или ждет
+_user_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def user_lock(user_id: int) -> asyncio.Lock:
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = _user_locks[user_id] = asyncio.Lock()
+    return lock
+
+def prepare():
+    backend.prepare()
+
+async def init_db():
+    await backend.init()
+
+async def ensure_user_exists(user_id: int, username: str):
+    await backend.ensure_user_exists(user_id, username)
+
+async def ensure_chat_exists(chat_id: int):
+    await backend.ensure_chat_exists(chat_id)
+
+async def add_game_record(user_id: int, username: str, chat_id: int, game_id: str, points: int):
+    await backend.add_game_record(user_id, username, chat_id, game_id, points)
+
+async def get_stats(period: str, chat_id: int, limit: int = None, offset: int = 0):
+    return await backend.get_stats(period, chat_id, limit, offset)
+
+async def update_player(user_id: int, username: str, points: int, chat_id: int, game_id: str = None):
+    await backend.update_player(user_id, username, points, chat_id, game_id)
+
+async def get_user_tokens(user_id: int) -> int:
+    return await backend.get_user_tokens(user_id)
+
+async def try_debit(user_id: int, amount: int, reason: str = REASON_BET) -> Optional[int]:
+    return await backend.try_debit(user_id, amount, reason)
+
+async def update_user_tokens(user_id: int, amount: int, reason: str = REASON_ADJUST):
+    await backend.update_user_tokens(user_id, amount, reason)
+
+async def get_balance_at(user_id: int, at: float = None) -> int:
+    return await backend.get_balance_at(user_id, at)
+
+async def get_stats_at(chat_id: int, at: float, limit: int = None, offset: int = 0):
+    return await backend.get_stats_at(chat_id, at, limit, offset)
+
+async def save_cooldown(scope: str, key: int, expires_at: float):
+    await backend.save_cooldown(scope, key, expires_at)
+
+async def load_cooldowns(scope: str) -> dict:
+    return await backend.load_cooldowns(scope)
+
+async def claim_cooldown(scope: str, key: int, duration: float) -> float:
+    return await backend.claim_cooldown(scope, key, duration)
+
+async def release_cooldown(scope: str, key: int):
+    await backend.release_cooldown(scope, key)
+
+async def run_in_transaction(func, *args):
+    return await backend.run_in_transaction(func, *args)
+
+async def incremental_vacuum(pages: int):
+    await backend.incremental_vacuum(pages)
+
+def balance_cache_metrics() -> dict:
+    return backend.balance_cache_metrics()
+
+async def flush_pending():
+    await backend.flush_pending()
+
+async def flush_periodically():
+    """Фоновая задача: сбрасывает очередь записи не реже FLUSH_INTERVAL"""
+    while True:
+        await asyncio.sleep(database.FLUSH_INTERVAL)
+        try:
+            await flush_pending()
+        except Exception as e:
+            # Очередь сохраняется и будет записана следующим сбросом
+            logger.error(f"Ошибка сброса очереди записи: {e}")
+
+async def close():
+    await backend.close()
+
+def shutdown():
+    """Дожидается завершения всех операций с хранилищем"""
+    backend.shutdown()
@@ -0,0 +1,128 @@
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import STORAGE_BACKEND
+
+# Интерфейс хранилища бота: пользователи, чаты, история игр, балансы,
+# статистика и кулдауны. storage.py передает вызовы выбранной реализации:
+#   sqlite   - database.py в отдельном потоке (по умолчанию)
+#   memory   - словари в памяти процесса, для тестов и бенчмарков
+#   postgres - общий сервер PostgreSQL с пулом соединений (asyncpg);
+#              несколько процессов и машин ведут один баланс игроков
+
+# Причины изменения баланса в журнале token_journal
+REASON_BET = 'bet'
+REASON_WIN = 'win'
+REASON_COOKIE = 'cookie'
+REASON_REFUND = 'refund'
+REASON_FREE = 'free'
+REASON_ADJUST = 'adjust'
+
+# Снимок баланса делается после стольких записей журнала пользователя
+SNAPSHOT_EVERY = 100
+
+class StorageBackend(ABC):
+    """Все методы, кроме prepare/shutdown/balance_cache_metrics, вызываются из event loop"""
+
+    # Данные видны нескольким процессам: можно шардировать бот (sharding.py)
+    multi_process = True
+    # Свертка истории и возврат места на диске (maintenance.py):
+    # run_in_transaction и incremental_vacuum работают только при True
+    supports_maintenance = False
+
+    def prepare(self):
+        """Синхронная подготовка до запуска event loop (например, миграции)"""
+
+    @abstractmethod
+    async def init(self):
+        """Подключение и создание схемы; вызывается в post_init"""
+
+    @abstractmethod
+    async def ensure_user_exists(self, user_id: int, username: str):
+        ...
+
+    @abstractmethod
+    async def ensure_chat_exists(self, chat_id: int):
+        ...
+
+    @abstractmethod
+    async def add_game_record(self, user_id: int, username: str, chat_id: int, game_id: str, points: int):
+        ...
+
+    @abstractmethod
+    async def get_stats(self, period: str, chat_id: int, limit: int = None, offset: int = 0) -> List[Tuple[str, int]]:
+        """[(username, tokens)] игроков, выигрывавших в чате за период, по убыванию баланса"""
+
+    @abstractmethod
+    async def update_player(self, user_id: int, username: str, points: int, chat_id: int, game_id: str = None):
+        """Записывает выигрыш (points > 0) в историю и начисляет его"""
+
+    @abstractmethod
+    async def get_user_tokens(self, user_id: int) -> int:
+        ...
+
+    @abstractmethod
+    async def try_debit(self, user_id: int, amount: int, reason: str) -> Optional[int]:
+        """Атомарно списывает amount, если хватает. Возвращает новый баланс или None"""
+
+    @abstractmethod
+    async def update_user_tokens(self, user_id: int, amount: int, reason: str):
+        ...
+
+    @abstractmethod
+    async def get_balance_at(self, user_id: int, at: float = None) -> int:
+        """Баланс пользователя на момент at по журналу изменений"""
+
+    @abstractmethod
+    async def get_stats_at(self, chat_id: int, at: float, limit: int = None, offset: int = 0) -> List[Tuple[str, int]]:
+        """[(username, tokens)] игроков, выигравших в чате до at, по убыванию баланса на тот момент"""
+
+    @abstractmethod
+    async def save_cooldown(self, scope: str, key: int, expires_at: float):
+        ...
+
+    @abstractmethod
+    async def load_cooldowns(self, scope: str) -> Dict[int, float]:
+        ...
+
+    @abstractmethod
+    async def claim_cooldown(self, scope: str, key: int, duration: float) -> float:
+        """
+        Атомарно запускает кулдаун, если он истек или не задан. Возвращает 0,
+        если кулдаун запущен этим вызовом, иначе сколько секунд осталось
+        """
+
+    @abstractmethod
+    async def release_cooldown(self, scope: str, key: int):
+        """Снимает кулдаун, запущенный claim_cooldown"""
+
+    async def flush_pending(self):
+        """Записывает отложенные изменения, если реализация их копит"""
+
+    async def run_in_transaction(self, func: Callable, *args):
+        """Выполняет func(cursor, *args) в одной транзакции (при supports_maintenance)"""
+
+    async def incremental_vacuum(self, pages: int):
+        """Возвращает файловой системе свободные страницы (при supports_maintenance)"""
+
+    def balance_cache_metrics(self) -> Dict[str, float]:
+        return {}
+
+    async def close(self):
+        """Освобождает ресурсы, привязанные к event loop (пул соединений)"""
+
+    def shutdown(self):
+        """Синхронное завершение после остановки event loop"""
+
+def create_backend(name: str = STORAGE_BACKEND) -> StorageBackend:
+    # Реализации импортируются по требованию: asyncpg - необязательная зависимость
+    if name == "sqlite":
+        from storage_sqlite import SQLiteBackend
+        return SQLiteBackend()
+    if name == "memory":
+        from storage_memory import MemoryBackend
+        return MemoryBackend()
+    if name == "postgres":
+        from storage_postgres import PostgresBackend
+        return PostgresBackend()
+    raise ValueError(f"Неизвестное хранилище: {name}")
@@ -0,0 +1,117 @@
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import leaderboard
+from storage_backend import REASON_WIN, StorageBackend
+
+class MemoryBackend(StorageBackend):
+    """
+    Хранилище в памяти процесса: без файлов и потоков, данные теряются при
+    остановке. Семантика та же, что у SQLite: начисление несуществующему
+    пользователю игнорируется, статистика показывает игроков с выигрышем
+    в окне периода
+    """
+
+    # У каждого процесса был бы свой баланс игроков
+    multi_process = False
+
+    def __init__(self):
+        self.users: Dict[int, List] = {}  # user_id -> [username, tokens]
+        self.chats = set()
+        self.history: List[Tuple[float, int, int, str, int]] = []
+        # Время последнего выигрыша: chat_id -> {user_id: время}
+        self._last_win: Dict[int, Dict[int, float]] = defaultdict(dict)
+        self.journal: Dict[int, List[Tuple[float, int, str]]] = defaultdict(list)
+        self.cooldowns: Dict[Tuple[str, int], float] = {}
+
+    async def init(self):
+        pass
+
+    async def ensure_user_exists(self, user_id: int, username: str):
+        user = self.users.get(user_id)
+        if user is None:
+            self.users[user_id] = [username, 0]
+        else:
+            user[0] = username
+
+    async def ensure_chat_exists(self, chat_id: int):
+        self.chats.add(chat_id)
+
+    async def add_game_record(self, user_id: int, username: str, chat_id: int, game_id: str, points: int):
+        await self.ensure_user_exists(user_id, username)
+        self.chats.add(chat_id)
+        now = time.time()
+        self.history.append((now, user_id, chat_id, game_id, points))
+        self._last_win[chat_id][user_id] = now
+
+    async def get_stats(self, period: str, chat_id: int, limit: int = None, offset: int = 0):
+        winners = self._last_win.get(chat_id, {})
+        window = leaderboard.WINDOWS.get(period)
+        if window is not None:
+            since = time.time() - window[2]
+            winners = {user_id: at for user_id, at in winners.items() if at >= since}
+        rows = sorted(
+            ((self.users[user_id][0], self.users[user_id][1]) for user_id in winners
+             if self.users[user_id][1] > 0),
+            key=lambda row: row[1], reverse=True,
+        )
+        return rows[offset:] if limit is None else rows[offset:offset + limit]
+
+    async def update_player(self, user_id: int, username: str, points: int, chat_id: int, game_id: str = None):
+        if points > 0:
+            await self.add_game_record(user_id, username, chat_id, game_id, points)
+            await self.update_user_tokens(user_id, points, REASON_WIN)
+
+    async def get_user_tokens(self, user_id: int) -> int:
+        user = self.users.get(user_id)
+        return user[1] if user else 0
+
+    async def try_debit(self, user_id: int, amount: int, reason: str) -> Optional[int]:
+        user = self.users.get(user_id)
+        if user is None or user[1] < amount:
+            return None
+        user[1] -= amount
+        self.journal[user_id].append((time.time(), -amount, reason))
+        return user[1]
+
+    async def update_user_tokens(self, user_id: int, amount: int, reason: str):
+        user = self.users.get(user_id)
+        if user is None:
+            return
+        user[1] += amount
+        self.journal[user_id].append((time.time(), amount, reason))
+
+    async def get_balance_at(self, user_id: int, at: float = None) -> int:
+        if at is None:
+            at = time.time()
+        return sum(delta for created_at, delta, _ in self.journal.get(user_id, ()) if created_at <= at)
+
+    async def get_stats_at(self, chat_id: int, at: float, limit: int = None, offset: int = 0):
+        winners = {user_id for played_at, user_id, history_chat, _, _ in self.history
+                   if history_chat == chat_id and played_at <= at}
+        rows = [(self.users[user_id][0], await self.get_balance_at(user_id, at)) for user_id in winners]
+        rows = sorted((row for row in rows if row[1] > 0), key=lambda row: row[1], reverse=True)
+        return rows[offset:] if limit is None else rows[offset:offset + limit]
+
+    async def save_cooldown(self, scope: str, key: int, expires_at: float):
+        self.cooldowns[(scope, key)] = expires_at
+
+    async def load_cooldowns(self, scope: str) -> Dict[int, float]:
+        now = time.time()
+        for cooldown, expires_at in list(self.cooldowns.items()):
+            if expires_at <= now:
+                del self.cooldowns[cooldown]
+        return {key: expires_at for (cooldown_scope, key), expires_at in self.cooldowns.items()
+                if cooldown_scope == scope}
+
+    async def claim_cooldown(self, scope: str, key: int, duration: float) -> float:
+        now = time.time()
+        expires_at = self.cooldowns.get((scope, key), 0.0)
+        if expires_at > now:
+            return expires_at - now
+        self.cooldowns[(scope, key)] = now + duration
+        return 0.0
+
+    async def release_cooldown(self, scope: str, key: int):
+        self.cooldowns.pop((scope, key), None)
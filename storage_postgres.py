@@ -0,0 +1,363 @@
+import time
+from typing import Dict, Optional
+
+try:
+    import asyncpg
+except ImportError:  # Необязательная зависимость: нужна только для STORAGE_BACKEND=postgres
+    asyncpg = None
+
+import leaderboard
+from config import POSTGRES_DSN, POSTGRES_POOL_MAX, POSTGRES_POOL_MIN
+from metrics import timed_db
+from storage_backend import REASON_WIN, SNAPSHOT_EVERY, StorageBackend
+
+# Хранилище в PostgreSQL (asyncpg). Не проверено на настоящем сервере: его покрывает
+# только benchmarks/storage_roundtrip.py, который без POSTGRES_DSN пропускает проверку
+
+# Ключ advisory-блокировки: схему создает только один процесс
+SCHEMA_LOCK = 0x6A6F6B6572
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT NOT NULL,
+        tokens BIGINT NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chats (
+        chat_id BIGINT PRIMARY KEY,
+        chat_name TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS game_history (
+        history_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT REFERENCES users (user_id),
+        chat_id BIGINT REFERENCES chats (chat_id),
+        game_id TEXT,
+        points INTEGER,
+        played_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_history_chat_played ON game_history (chat_id, played_at, user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_users_tokens ON users (tokens)',
+    '''
+    CREATE TABLE IF NOT EXISTS token_journal (
+        entry_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        delta BIGINT NOT NULL,
+        reason TEXT NOT NULL,
+        created_at DOUBLE PRECISION NOT NULL
+    )
+    ''',
+    # Записи после снимка баланса выбираются диапазоном по entry_id
+    'CREATE INDEX IF NOT EXISTS idx_journal_user_entry ON token_journal (user_id, entry_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        user_id BIGINT,
+        entry_id BIGINT,
+        balance BIGINT NOT NULL,
+        taken_at DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (user_id, entry_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS cooldowns (
+        scope TEXT,
+        key BIGINT,
+        expires_at DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (scope, key)
+    )
+    ''',
+    # Агрегаты выигрышей для статистики, как в leaderboard.py
+    '''
+    CREATE TABLE IF NOT EXISTS leaderboard_total (
+        chat_id BIGINT,
+        user_id BIGINT,
+        points BIGINT NOT NULL DEFAULT 0,
+        wins BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, user_id)
+    )
+    ''',
+] + [
+    f'''
+    CREATE TABLE IF NOT EXISTS {table} (
+        chat_id BIGINT,
+        bucket BIGINT,
+        user_id BIGINT,
+        points BIGINT NOT NULL DEFAULT 0,
+        wins BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, bucket, user_id)
+    )
+    '''
+    for table, _ in leaderboard.BUCKET_TABLES
+]
+
+class PostgresBackend(StorageBackend):
+    """
+    Хранилище на общем сервере PostgreSQL через пул соединений asyncpg.
+    Каждая операция - отдельная короткая транзакция; списание блокирует
+    только строку пользователя, поэтому процессы на разных машинах могут
+    писать одновременно и вести один баланс
+    """
+
+    def __init__(self, dsn: str = POSTGRES_DSN, min_size: int = POSTGRES_POOL_MIN, max_size: int = POSTGRES_POOL_MAX,
+                 schema: str = None):
+        """schema - отдельная схема PostgreSQL для таблиц бота (проверки, тесты); по умолчанию public"""
+        if asyncpg is None:
+            raise RuntimeError("Для STORAGE_BACKEND=postgres нужен пакет asyncpg (pip install asyncpg)")
+        if not dsn:
+            raise RuntimeError("Не задан POSTGRES_DSN в env.txt")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.schema = schema
+        self.pool = None
+
+    async def init(self):
+        server_settings = {'search_path': self.schema} if self.schema else None
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size,
+                                              server_settings=server_settings)
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute('SELECT pg_advisory_xact_lock($1)', SCHEMA_LOCK)
+                if self.schema:
+                    await connection.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+                for statement in SCHEMA:
+                    await connection.execute(statement)
+                await self._fill_leaderboard(connection)
+
+    @staticmethod
+    async def _fill_leaderboard(connection):
+        """Переносит накопленную историю в агрегаты (один раз, при пустых агрегатах)"""
+        if await connection.fetchval('SELECT EXISTS (SELECT 1 FROM leaderboard_total)'):
+            return
+        await connection.execute('''
+            INSERT INTO leaderboard_total (chat_id, user_id, points, wins)
+            SELECT chat_id, user_id, SUM(points), COUNT(*)
+            FROM game_history
+            WHERE chat_id IS NOT NULL AND user_id IS NOT NULL
+            GROUP BY chat_id, user_id
+        ''')
+        for table, size in leaderboard.BUCKET_TABLES:
+            await connection.execute(f'''
+                INSERT INTO {table} (chat_id, bucket, user_id, points, wins)
+                SELECT chat_id, CAST(EXTRACT(EPOCH FROM played_at) AS BIGINT) / {size},
+                       user_id, SUM(points), COUNT(*)
+                FROM game_history
+                WHERE chat_id IS NOT NULL AND user_id IS NOT NULL
+                GROUP BY 1, 2, 3
+            ''')
+
+    @staticmethod
+    async def _upsert_user(connection, user_id: int, username: str):
+        await connection.execute('''
+            INSERT INTO users (user_id, username) VALUES ($1, $2)
+            ON CONFLICT (user_id) DO UPDATE SET username = excluded.username
+        ''', user_id, username)
+
+    @staticmethod
+    async def _journal(connection, user_id: int, delta: int, reason: str, tokens: int):
+        """
+        Запись журнала после изменения баланса (строка пользователя уже заблокирована).
+        Каждые SNAPSHOT_EVERY записей пользователя - снимок баланса для get_balance_at
+        """
+        now = time.time()
+        entry_id = await connection.fetchval('''
+            INSERT INTO token_journal (user_id, delta, reason, created_at) VALUES ($1, $2, $3, $4)
+            RETURNING entry_id
+        ''', user_id, delta, reason, now)
+        since_snapshot = await connection.fetchval('''
+            SELECT COUNT(*) FROM token_journal
+            WHERE user_id = $1 AND entry_id > (
+                SELECT COALESCE(MAX(entry_id), 0) FROM balance_snapshots WHERE user_id = $1
+            )
+        ''', user_id)
+        if since_snapshot >= SNAPSHOT_EVERY:
+            await connection.execute(
+                'INSERT INTO balance_snapshots (user_id, entry_id, balance, taken_at) VALUES ($1, $2, $3, $4)',
+                user_id, entry_id, tokens, now)
+
+    async def _add_tokens(self, connection, user_id: int, amount: int, reason: str) -> Optional[int]:
+        """Начисление и запись в журнал; несуществующий пользователь пропускается"""
+        tokens = await connection.fetchval(
+            'UPDATE users SET tokens = tokens + $1 WHERE user_id = $2 RETURNING tokens', amount, user_id)
+        if tokens is not None:
+            await self._journal(connection, user_id, amount, reason, tokens)
+        return tokens
+
+    async def _record_game(self, connection, user_id: int, username: str, chat_id: int, game_id: str, points: int):
+        await self._upsert_user(connection, user_id, username)
+        await connection.execute('INSERT INTO chats (chat_id) VALUES ($1) ON CONFLICT DO NOTHING', chat_id)
+        await connection.execute(
+            'INSERT INTO game_history (user_id, chat_id, game_id, points) VALUES ($1, $2, $3, $4)',
+            user_id, chat_id, game_id, points)
+        await connection.execute('''
+            INSERT INTO leaderboard_total (chat_id, user_id, points, wins) VALUES ($1, $2, $3, 1)
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                points = leaderboard_total.points + excluded.points,
+                wins = leaderboard_total.wins + 1
+        ''', chat_id, user_id, points)
+        now = int(time.time())
+        for table, size in leaderboard.BUCKET_TABLES:
+            await connection.execute(f'''
+                INSERT INTO {table} (chat_id, bucket, user_id, points, wins) VALUES ($1, $2, $3, $4, 1)
+                ON CONFLICT (chat_id, bucket, user_id) DO UPDATE SET
+                    points = {table}.points + excluded.points,
+                    wins = {table}.wins + 1
+            ''', chat_id, now // size, user_id, points)
+
+    @timed_db
+    async def ensure_user_exists(self, user_id: int, username: str):
+        async with self.pool.acquire() as connection:
+            await self._upsert_user(connection, user_id, username)
+
+    @timed_db
+    async def ensure_chat_exists(self, chat_id: int):
+        await self.pool.execute('INSERT INTO chats (chat_id) VALUES ($1) ON CONFLICT DO NOTHING', chat_id)
+
+    @timed_db
+    async def add_game_record(self, user_id: int, username: str, chat_id: int, game_id: str, points: int):
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await self._record_game(connection, user_id, username, chat_id, game_id, points)
+
+    @timed_db
+    async def get_stats(self, period: str, chat_id: int, limit: int = None, offset: int = 0):
+        # Игроки окна - из агрегатов по корзинам (leaderboard.py), без чтения истории
+        window = leaderboard.WINDOWS.get(period)
+        if window is None:
+            players = 'SELECT user_id FROM leaderboard_total WHERE chat_id = $1'
+            params = (chat_id, limit, offset)
+        else:
+            table, size, length = window
+            players = f'SELECT user_id FROM {table} WHERE chat_id = $1 AND bucket >= $4'
+            params = (chat_id, limit, offset, (int(time.time()) - length) // size)
+        rows = await self.pool.fetch(f'''
+            SELECT u.username, u.tokens
+            FROM users u
+            WHERE u.user_id IN ({players})
+            AND u.tokens > 0
+            ORDER BY u.tokens DESC
+            LIMIT $2 OFFSET $3
+        ''', *params)
+        return [tuple(row) for row in rows]
+
+    @timed_db
+    async def update_player(self, user_id: int, username: str, points: int, chat_id: int, game_id: str = None):
+        if points <= 0:  # Записываем только выигрыши
+            return
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await self._record_game(connection, user_id, username, chat_id, game_id, points)
+                await self._add_tokens(connection, user_id, points, REASON_WIN)
+
+    @timed_db
+    async def get_user_tokens(self, user_id: int) -> int:
+        tokens = await self.pool.fetchval('SELECT tokens FROM users WHERE user_id = $1', user_id)
+        return tokens or 0
+
+    @timed_db
+    async def try_debit(self, user_id: int, amount: int, reason: str) -> Optional[int]:
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                tokens = await connection.fetchval('''
+                    UPDATE users SET tokens = tokens - $1
+                    WHERE user_id = $2 AND tokens >= $1
+                    RETURNING tokens
+                ''', amount, user_id)
+                if tokens is not None:
+                    await self._journal(connection, user_id, -amount, reason, tokens)
+                return tokens
+
+    @timed_db
+    async def update_user_tokens(self, user_id: int, amount: int, reason: str):
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await self._add_tokens(connection, user_id, amount, reason)
+
+    @timed_db
+    async def get_balance_at(self, user_id: int, at: float = None) -> int:
+        if at is None:
+            at = time.time()
+        # Последний снимок до момента at плюс записи журнала после него
+        async with self.pool.acquire() as connection:
+            snapshot = await connection.fetchrow('''
+                SELECT entry_id, balance FROM balance_snapshots
+                WHERE user_id = $1 AND taken_at <= $2
+                ORDER BY entry_id DESC LIMIT 1
+            ''', user_id, at)
+            entry_id, balance = (snapshot['entry_id'], snapshot['balance']) if snapshot else (0, 0)
+            delta = await connection.fetchval('''
+                SELECT COALESCE(SUM(delta), 0)::BIGINT FROM token_journal
+                WHERE user_id = $1 AND entry_id > $2 AND created_at <= $3
+            ''', user_id, entry_id, at)
+        return balance + delta
+
+    @timed_db
+    async def get_stats_at(self, chat_id: int, at: float, limit: int = None, offset: int = 0):
+        # Баланс каждого игрока - последний снимок до at плюс журнал после него
+        rows = await self.pool.fetch('''
+            SELECT username, balance FROM (
+                SELECT u.username,
+                       COALESCE(s.balance, 0) + (
+                           SELECT COALESCE(SUM(j.delta), 0)::BIGINT FROM token_journal j
+                           WHERE j.user_id = u.user_id AND j.entry_id > COALESCE(s.entry_id, 0)
+                           AND j.created_at <= $2
+                       ) AS balance
+                FROM users u
+                LEFT JOIN balance_snapshots s ON s.user_id = u.user_id AND s.entry_id = (
+                    SELECT MAX(entry_id) FROM balance_snapshots WHERE user_id = u.user_id AND taken_at <= $2
+                )
+                WHERE u.user_id IN (
+                    SELECT user_id FROM game_history WHERE chat_id = $1 AND played_at <= to_timestamp($2)
+                )
+            ) AS players
+            WHERE balance > 0
+            ORDER BY balance DESC
+            LIMIT $3 OFFSET $4
+        ''', chat_id, at, limit, offset)
+        return [tuple(row) for row in rows]
+
+    @timed_db
+    async def save_cooldown(self, scope: str, key: int, expires_at: float):
+        await self.pool.execute('''
+            INSERT INTO cooldowns (scope, key, expires_at) VALUES ($1, $2, $3)
+            ON CONFLICT (scope, key) DO UPDATE SET expires_at = excluded.expires_at
+        ''', scope, key, expires_at)
+
+    @timed_db
+    async def load_cooldowns(self, scope: str) -> Dict[int, float]:
+        now = time.time()
+        async with self.pool.acquire() as connection:
+            await connection.execute('DELETE FROM cooldowns WHERE scope = $1 AND expires_at <= $2', scope, now)
+            rows = await connection.fetch('SELECT key, expires_at FROM cooldowns WHERE scope = $1', scope)
+        return {row['key']: row['expires_at'] for row in rows}
+
+    @timed_db
+    async def claim_cooldown(self, scope: str, key: int, duration: float) -> float:
+        now = time.time()
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                claimed = await connection.fetchval('''
+                    INSERT INTO cooldowns (scope, key, expires_at) VALUES ($1, $2, $3)
+                    ON CONFLICT (scope, key) DO UPDATE SET expires_at = excluded.expires_at
+                    WHERE cooldowns.expires_at <= $4
+                    RETURNING expires_at
+                ''', scope, key, now + duration, now)
+                if claimed is not None:
+                    return 0.0
+                expires_at = await connection.fetchval(
+                    'SELECT expires_at FROM cooldowns WHERE scope = $1 AND key = $2', scope, key)
+        return max(expires_at - now, 0.0)
+
+    @timed_db
+    async def release_cooldown(self, scope: str, key: int):
+        await self.pool.execute('DELETE FROM cooldowns WHERE scope = $1 AND key = $2', scope, key)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
@@ -0,0 +1,101 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import database
+from storage_backend import StorageBackend
+
+class SQLiteBackend(StorageBackend):
+    """
+    Хранилище на SQLite (database.py). Все обращения к SQLite выполняются
+    в одном выделенном потоке: соединение в database.py общее, а event loop
+    бота не блокируется. Статистика в режиме WAL читается в своем потоке
+    и не ждет записи
+    """
+
+    supports_maintenance = True
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self._read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-read")
+
+    async def _run(self, func, *args, **kwargs):
+        """Выполняет синхронную функцию database.py в потоке БД"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def _run_read(self, func, *args, **kwargs):
+        """Выполняет запрос на чтение в потоке читателя"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, partial(func, *args, **kwargs))
+
+    def prepare(self):
+        database.init_db()
+
+    async def init(self):
+        # Повторный вызов после prepare() только сверяет версию схемы
+        await self._run(database.init_db)
+
+    async def ensure_user_exists(self, user_id: int, username: str):
+        await self._run(database.ensure_user_exists, user_id, username)
+
+    async def ensure_chat_exists(self, chat_id: int):
+        await self._run(database.ensure_chat_exists, chat_id)
+
+    async def add_game_record(self, user_id: int, username: str, chat_id: int, game_id: str, points: int):
+        await self._run(database.add_game_record, user_id, username, chat_id, game_id, points)
+
+    async def get_stats(self, period: str, chat_id: int, limit: int = None, offset: int = 0):
+        if not database.uses_stats_reader():
+            return await self._run(database.get_stats, period, chat_id, limit, offset)
+        # Читатель видит только зафиксированные данные
+        await self.flush_pending()
+        return await self._run_read(database.get_stats, period, chat_id, limit, offset)
+
+    async def update_player(self, user_id: int, username: str, points: int, chat_id: int, game_id: str = None):
+        await self._run(database.update_player, user_id, username, points, chat_id, game_id)
+
+    async def get_user_tokens(self, user_id: int) -> int:
+        return await self._run(database.get_user_tokens, user_id)
+
+    async def try_debit(self, user_id: int, amount: int, reason: str):
+        return await self._run(database.try_debit, user_id, amount, reason)
+
+    async def update_user_tokens(self, user_id: int, amount: int, reason: str):
+        await self._run(database.update_user_tokens, user_id, amount, reason)
+
+    async def get_balance_at(self, user_id: int, at: float = None) -> int:
+        return await self._run(database.get_balance_at, user_id, at)
+
+    async def get_stats_at(self, chat_id: int, at: float, limit: int = None, offset: int = 0):
+        return await self._run(database.get_stats_at, chat_id, at, limit, offset)
+
+    async def save_cooldown(self, scope: str, key: int, expires_at: float):
+        await self._run(database.save_cooldown, scope, key, expires_at)
+
+    async def load_cooldowns(self, scope: str) -> dict:
+        return await self._run(database.load_cooldowns, scope)
+
+    async def claim_cooldown(self, scope: str, key: int, duration: float) -> float:
+        return await self._run(database.claim_cooldown, scope, key, duration)
+
+    async def release_cooldown(self, scope: str, key: int):
+        await self._run(database.release_cooldown, scope, key)
+
+    async def flush_pending(self):
+        await self._run(database.flush_pending)
+
+    async def run_in_transaction(self, func, *args):
+        return await self._run(database.run_in_transaction, func, *args)
+
+    async def incremental_vacuum(self, pages: int):
+        await self._run(database.incremental_vacuum, pages)
+
+    def balance_cache_metrics(self) -> dict:
+        return database.balance_cache_metrics()
+
+    def shutdown(self):
+        """Дожидается завершения всех операций с БД и сбрасывает очередь записи"""
+        self._read_executor.shutdown(wait=True)
+        self._executor.shutdown(wait=True)
+        database.flush_pending()
@@ -0,0 +1,244 @@
+"""
+Прием обновлений через вебхук на asyncio-сервере
+
+Сервер можно проверить без Telegram:
+
+    python webhook.py --echo                      # принимать и печатать обновления
+    python webhook.py --post updates.jsonl        # отправить записанные обновления
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import signal
+import urllib.request
+from typing import Awaitable, Callable, Optional
+
+from config import (
+    WEBHOOK_LISTEN,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    logger,
+)
+
+MAX_BODY_SIZE = 1024 * 1024
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+READ_TIMEOUT = 10.0  # На чтение заголовков и тела начатого запроса, с
+IDLE_TIMEOUT = 60.0  # Сколько keep-alive соединение ждет следующего запроса, с
+
+class RequestError(Exception):
+    """Запрос не прочитан: ответить status и закрыть соединение"""
+
+    def __init__(self, status: str):
+        super().__init__(status)
+        self.status = status
+
+class WebhookServer:
+    """
+    Минимальный HTTP/1.1 сервер для вебхука Telegram
+    Принимает только POST на path, проверяет секретный заголовок и передает
+    разобранный JSON в on_update. Число одновременных соединений ограничено
+    """
+
+    def __init__(
+        self,
+        on_update: Callable[[dict], Awaitable[None]],
+        listen: str = WEBHOOK_LISTEN,
+        port: int = WEBHOOK_PORT,
+        path: str = WEBHOOK_PATH,
+        secret_token: str = WEBHOOK_SECRET,
+        max_connections: int = WEBHOOK_MAX_CONNECTIONS,
+        read_timeout: float = READ_TIMEOUT,
+        idle_timeout: float = IDLE_TIMEOUT,
+    ):
+        self.on_update = on_update
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_connections = max_connections
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self.received = 0
+        self.rejected = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info(f"Вебхук слушает http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _respond(self, writer, status: str, keep_alive: bool):
+        connection = "keep-alive" if keep_alive else "close"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: {connection}\r\n\r\n".encode())
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self.connections >= self.max_connections:
+            self.rejected += 1
+            await self._respond(writer, "503 Service Unavailable", False)
+            writer.close()
+            return
+        self.connections += 1
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # ValueError - строка длиннее предела StreamReader
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader, request_line: bytes):
+        """Читает заголовки и тело запроса. Возвращает (method, path, keep_alive, headers, body)"""
+        try:
+            method, path, version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise RequestError("400 Bad Request")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        length = headers.get("content-length", "0")
+        if not (length.isascii() and length.isdigit()):
+            raise RequestError("400 Bad Request")
+        length = int(length)
+        if length > MAX_BODY_SIZE:
+            raise RequestError("413 Payload Too Large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path, keep_alive, headers, body
+
+    async def _handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Обрабатывает один запрос. Возвращает True, если соединение остается открытым"""
+        # Простаивающее keep-alive соединение закрываем: оно занимает место в max_connections
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            return False
+        if not request_line:
+            return False
+        # Медленный клиент не должен держать соединение, отправляя запрос по байту
+        try:
+            method, path, keep_alive, headers, body = await asyncio.wait_for(
+                self._read_request(reader, request_line), self.read_timeout)
+        except asyncio.TimeoutError:
+            await self._respond(writer, "408 Request Timeout", False)
+            return False
+        except RequestError as e:
+            await self._respond(writer, e.status, False)
+            return False
+
+        if method != "POST" or path != self.path:
+            await self._respond(writer, "404 Not Found", keep_alive)
+            return keep_alive
+        if self.secret_token and not hmac.compare_digest(headers.get(SECRET_HEADER, ""), self.secret_token):
+            self.rejected += 1
+            await self._respond(writer, "403 Forbidden", keep_alive)
+            return keep_alive
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        # Обновление Telegram - всегда JSON-объект
+        if not isinstance(data, dict):
+            await self._respond(writer, "400 Bad Request", keep_alive)
+            return keep_alive
+
+        self.received += 1
+        await self.on_update(data)
+        await self._respond(writer, "200 OK", keep_alive)
+        return keep_alive
+
+async def run_application(application):
+    """Запускает приложение с приемом обновлений через вебхук вместо run_polling"""
+    from telegram import Update
+
+    async def enqueue(data: dict):
+        # Обработка идет в приложении с ограничением concurrent_updates
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    server = WebhookServer(enqueue)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await server.start()
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def post_updates(file_path: str, url: str, secret_token: str = WEBHOOK_SECRET):
+    """Отправляет записанные обновления (по одному JSON в строке) на вебхук"""
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            request = urllib.request.Request(url, data=line.encode("utf-8"), method="POST")
+            request.add_header("Content-Type", "application/json")
+            if secret_token:
+                request.add_header("X-Telegram-Bot-Api-Secret-Token", secret_token)
+            with urllib.request.urlopen(request) as response:
+                print(response.status, line.strip()[:80])
+
+async def _echo():
+    async def on_update(data: dict):
+        print(json.dumps(data, ensure_ascii=False))
+
+    server = WebhookServer(on_update)
+    await server.start()
+    await asyncio.Event().wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--echo", action="store_true", help="принимать обновления и печатать их")
+    group.add_argument("--post", metavar="FILE", help="отправить обновления из файла")
+    parser.add_argument("--url", default=f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    args = parser.parse_args()
+    if args.echo:
+        try:
+            asyncio.run(_echo())
+        except KeyboardInterrupt:
+            pass
+    else:
+        post_updates(args.post, args.url)
+
+if __name__ == "__main__":
+    main()